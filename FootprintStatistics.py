@@ -0,0 +1,197 @@
+import numpy as np
+
+# Constant time statistics of rectangular footprints on the 2D maps of the build area.
+#
+# Footprints are given in local build area coordinates as (x1, z1, x2, z2), with the far corner exclusive, which is the
+# same box mapTools.getCrop returns for a structure. Sums are read from summed-area tables (integral images) and the
+# maximum from a sliding-window maximum computed once for each footprint size. The maps can be changed afterwards, which
+# only recomputes the tiles of the tables and the parts of the maxima that the change touches.
+
+# Size of the tiles of the summed-area tables, one chunk.
+TILESIZE = 16
+
+
+class TiledSummedAreaTable:
+
+    # The table is split in tiles which each hold the sums within the tile. The sums of the whole tiles and of the
+    # partial rows and columns of tiles along the edges of a footprint are kept as prefix sums over the tiles, so a
+    # footprint is still read from a constant number of entries.
+    def __init__(self, grid=np.array([[]]), tileSize=TILESIZE):
+        self.tileSize = tileSize
+        self.values = np.array(grid, dtype=np.int64)
+        self.tileCount = (-(-self.values.shape[0] // tileSize), -(-self.values.shape[1] // tileSize))
+        # Index of the last row and column of each tile.
+        self.tileEndsX = np.minimum(np.arange(1, self.tileCount[0] + 1) * tileSize, self.values.shape[0]) - 1
+        self.tileEndsZ = np.minimum(np.arange(1, self.tileCount[1] + 1) * tileSize, self.values.shape[1]) - 1
+
+        # Inclusive sums from the near corner of the tile of each cell.
+        self.local = np.zeros(self.values.shape, dtype=np.int64)
+        # Sums of the partial tiles in each row left of each tile, and in each column above each tile.
+        self.rowStrips = np.zeros((self.values.shape[0], self.tileCount[1] + 1), dtype=np.int64)
+        self.columnStrips = np.zeros((self.tileCount[0] + 1, self.values.shape[1]), dtype=np.int64)
+        # Summed-area table of whole tiles.
+        self.tileTable = np.zeros((self.tileCount[0] + 1, self.tileCount[1] + 1), dtype=np.int64)
+        self._updateTiles(0, 0, *self.tileCount)
+
+    # Recompute the tiles from tileX1, tileZ1 up to (excluding) tileX2, tileZ2.
+    def _updateTiles(self, tileX1, tileZ1, tileX2, tileZ2):
+        if tileX2 <= tileX1 or tileZ2 <= tileZ1:
+            return
+        x1, z1 = tileX1 * self.tileSize, tileZ1 * self.tileSize
+        x2, z2 = min(tileX2 * self.tileSize, self.values.shape[0]), min(tileZ2 * self.tileSize, self.values.shape[1])
+        tiles = np.zeros(((tileX2 - tileX1) * self.tileSize, (tileZ2 - tileZ1) * self.tileSize), dtype=np.int64)
+        tiles[:x2 - x1, :z2 - z1] = self.values[x1:x2, z1:z2]
+        tiles = tiles.reshape(tileX2 - tileX1, self.tileSize, tileZ2 - tileZ1, self.tileSize)
+        tiles = np.cumsum(np.cumsum(tiles, axis=1), axis=3)
+        self.local[x1:x2, z1:z2] = tiles.reshape(tiles.shape[0] * self.tileSize, -1)[:x2 - x1, :z2 - z1]
+
+        # Only the rows and columns of the changed tiles have different strips.
+        np.cumsum(self.local[x1:x2][:, self.tileEndsZ], axis=1, out=self.rowStrips[x1:x2, 1:])
+        np.cumsum(self.local[self.tileEndsX][:, z1:z2], axis=0, out=self.columnStrips[1:, z1:z2])
+        tileSums = self.local[np.ix_(self.tileEndsX, self.tileEndsZ)]
+        np.cumsum(np.cumsum(tileSums, axis=0), axis=1, out=self.tileTable[1:, 1:])
+
+    # Sum of the cells before x, z (excluding), for arrays of coordinates.
+    def _getPrefixSum(self, x, z):
+        tileX, remainderX = np.divmod(x, self.tileSize)
+        tileZ, remainderZ = np.divmod(z, self.tileSize)
+        hasRow = remainderX > 0
+        hasColumn = remainderZ > 0
+        return self.tileTable[tileX, tileZ] \
+            + np.where(hasRow, self.rowStrips[x - 1, tileZ], 0) \
+            + np.where(hasColumn, self.columnStrips[tileX, z - 1], 0) \
+            + np.where(hasRow & hasColumn, self.local[x - 1, z - 1], 0)
+
+    def getSum(self, footprint):
+        x1, z1, x2, z2 = footprint
+        return self._getPrefixSum(x2, z2) - self._getPrefixSum(x1, z2) - self._getPrefixSum(x2, z1) \
+            + self._getPrefixSum(x1, z1)
+
+    # Sums of every footprint of the given size at once, indexed by the near corner of the footprint.
+    def getSumMap(self, sizeX, sizeZ):
+        x1 = np.arange(max(self.values.shape[0] - sizeX + 1, 0))[:, np.newaxis]
+        z1 = np.arange(max(self.values.shape[1] - sizeZ + 1, 0))[np.newaxis, :]
+        return self.getSum((x1, z1, x1 + sizeX, z1 + sizeZ))
+
+    # Set the values within a footprint and recompute the tiles it touches.
+    def update(self, footprint, values):
+        x1, z1, x2, z2 = footprint
+        self.values[x1:x2, z1:z2] = values
+        self._updateTiles(
+            x1 // self.tileSize, z1 // self.tileSize, -(-x2 // self.tileSize), -(-z2 // self.tileSize)
+        )
+
+
+class FootprintStatistics:
+
+    def __init__(self,
+                 baseLineHeightMap=np.array([]),
+                 oceanFloorHeightMap=np.array([]),
+                 mapOfStructures=np.array([])
+                 ):
+        self.heightMaps = {
+            'baseLine': baseLineHeightMap,
+            'oceanFloor': oceanFloorHeightMap
+        }
+        self.sums = {name: TiledSummedAreaTable(heightMap) for name, heightMap in self.heightMaps.items()}
+        self.squareSums = {
+            name: TiledSummedAreaTable(np.square(heightMap, dtype=np.int64))
+            for name, heightMap in self.heightMaps.items()
+        }
+        # Sliding-window maxima keyed by height map name and footprint size.
+        self.maxima = {}
+
+        # The map of structures is shared with the nodes, only change it through markOccupied.
+        self.mapOfStructures = mapOfStructures
+        self.occupancy = TiledSummedAreaTable(mapOfStructures > 0)
+
+    # Compute the maximum of every window of the given width along an axis by doubling the span of the maxima
+    # (a sparse table), combining the two overlapping spans that cover the window at the end.
+    @staticmethod
+    def _slidingMax(grid, width, axis):
+        length = grid.shape[axis] - width + 1
+        result = grid
+        span = 1
+        while span * 2 <= width:
+            result = np.maximum(
+                result.take(np.arange(result.shape[axis] - span), axis=axis),
+                result.take(np.arange(span, result.shape[axis]), axis=axis)
+            )
+            span *= 2
+        return np.maximum(
+            result.take(np.arange(length), axis=axis),
+            result.take(np.arange(width - span, width - span + length), axis=axis)
+        )
+
+    def contains(self, footprint):
+        x1, z1, x2, z2 = footprint
+        sizeX, sizeZ = self.mapOfStructures.shape
+        return 0 <= x1 < x2 <= sizeX and 0 <= z1 < z2 <= sizeZ
+
+    def getArea(self, footprint):
+        x1, z1, x2, z2 = footprint
+        return (x2 - x1) * (z2 - z1)
+
+    def getSum(self, heightMapName, footprint):
+        return self.sums[heightMapName].getSum(footprint)
+
+    def getMean(self, heightMapName, footprint):
+        return self.getSum(heightMapName, footprint) / self.getArea(footprint)
+
+    def getVariance(self, heightMapName, footprint):
+        mean = self.getMean(heightMapName, footprint)
+        return self.squareSums[heightMapName].getSum(footprint) / self.getArea(footprint) - mean**2
+
+    def getSumMap(self, heightMapName, sizeX, sizeZ):
+        return self.sums[heightMapName].getSumMap(sizeX, sizeZ)
+
+    def getMeanMap(self, heightMapName, sizeX, sizeZ):
+        return self.getSumMap(heightMapName, sizeX, sizeZ) / (sizeX * sizeZ)
+
+    def getVarianceMap(self, heightMapName, sizeX, sizeZ):
+        meanMap = self.getMeanMap(heightMapName, sizeX, sizeZ)
+        return self.squareSums[heightMapName].getSumMap(sizeX, sizeZ) / (sizeX * sizeZ) - meanMap**2
+
+    def getMaxMap(self, heightMapName, sizeX, sizeZ):
+        key = (heightMapName, sizeX, sizeZ)
+        if key not in self.maxima:
+            heightMap = self.heightMaps[heightMapName]
+            self.maxima[key] = self._slidingMax(self._slidingMax(heightMap, sizeX, 0), sizeZ, 1)
+        return self.maxima[key]
+
+    def getMax(self, heightMapName, footprint):
+        x1, z1, x2, z2 = footprint
+        return self.getMaxMap(heightMapName, x2 - x1, z2 - z1)[x1, z1]
+
+    def getOccupiedCount(self, footprint):
+        return self.occupancy.getSum(footprint)
+
+    def getOccupiedCountMap(self, sizeX, sizeZ):
+        return self.occupancy.getSumMap(sizeX, sizeZ)
+
+    def isOccupied(self, footprint):
+        return self.getOccupiedCount(footprint) > 0
+
+    # Set map of structures to a constant to indicate something is already been built here.
+    def markOccupied(self, footprint):
+        x1, z1, x2, z2 = footprint
+        self.mapOfStructures[x1:x2, z1:z2] = 1
+        self.occupancy.update(footprint, self.mapOfStructures[x1:x2, z1:z2] > 0)
+
+    # Change the height map within a footprint, updating the sums and the maxima of the footprints overlapping it.
+    def updateHeightMap(self, heightMapName, footprint, heights):
+        x1, z1, x2, z2 = footprint
+        heightMap = self.heightMaps[heightMapName]
+        heightMap[x1:x2, z1:z2] = heights
+        self.sums[heightMapName].update(footprint, heightMap[x1:x2, z1:z2])
+        self.squareSums[heightMapName].update(footprint, np.square(heightMap[x1:x2, z1:z2], dtype=np.int64))
+        for (name, sizeX, sizeZ), maxMap in self.maxima.items():
+            if name != heightMapName:
+                continue
+            originX1, originZ1 = max(x1 - sizeX + 1, 0), max(z1 - sizeZ + 1, 0)
+            originX2, originZ2 = min(x2, maxMap.shape[0]), min(z2, maxMap.shape[1])
+            if originX2 <= originX1 or originZ2 <= originZ1:
+                continue
+            maxMap[originX1:originX2, originZ1:originZ2] = self._slidingMax(self._slidingMax(
+                heightMap[originX1:originX2 + sizeX - 1, originZ1:originZ2 + sizeZ - 1], sizeX, 0
+            ), sizeZ, 1)
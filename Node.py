@@ -2,9 +2,12 @@ import numpy as np
 import copy
 import string
 import globals
+import interface
 import mapTools
 from Structure import Structure
 from StructurePrototype import StructurePrototype
+from TerrainAnalysis import TerrainAnalysis
+from WorldState import WorldState
 from materials import INVENTORYLOOKUP, INVENTORY, SOILS, PLANTS, TREES, AIR, UNDERWATERPLANTS, FARMLANDPLANTS, \
     DEEPOCEANBIOMES
 from worldLoader import WorldSlice
@@ -16,19 +19,20 @@ class Node:
                  x: int = 0, y: int = 0, z: int = 0,
                  parentStructure: Structure = None,
                  buildArea=(0, 0, 0, 0),
-                 mapOfStructures=np.array([]),
                  facing: int = None,
                  nodeStructurePrototype: StructurePrototype = None,
                  rng=np.random.default_rng(),
                  baseLineHeightMap=np.array([]),
                  oceanFloorHeightMap=np.array([]),
-                 worldSlice: WorldSlice = None
+                 worldSlice: WorldSlice = None,
+                 worldState: WorldState = None,
+                 terrainAnalysis: TerrainAnalysis = None
                  ):
 
         self.rng = rng
         self.buildArea = buildArea
-        self.mapOfStructures = mapOfStructures
         self.worldSlice = worldSlice
+        self.terrainAnalysis = terrainAnalysis
 
         # Create structure instance.
         self.structure = Structure(
@@ -59,6 +63,18 @@ class Node:
             globalCropFarCorner=self.structure.getFarCornerInWorldSpace()
         )
 
+        # Footprint of the structure in the build area, to look up its statistics in the settlement built so far.
+        if worldState is None:
+            worldState = WorldState(buildArea, baseLineHeightMap, oceanFloorHeightMap)
+        self.worldState = worldState
+        self.footprintStatistics = worldState.footprintStatistics
+        localOrigin, localFarCorner = mapTools.getCrop(
+            globalOrigin=buildArea[:2],
+            globalCropOrigin=self.structure.getOriginInWorldSpace(),
+            globalCropFarCorner=self.structure.getFarCornerInWorldSpace()
+        )
+        self.footprint = (*localOrigin, *localFarCorner)
+
         self.localBiome = worldSlice.getBiomeAt(*self.structure.getOriginInWorldSpace())
         self.isInDeepOcean = self.localBiome in DEEPOCEANBIOMES
 
@@ -81,22 +97,21 @@ class Node:
         if self.localHeightMapBaseLine.shape != (self.structure.getSizeX(), self.structure.getSizeZ()):
             return None
 
+        # Crops starting outside the build area can still have the right shape, as negative indices wrap around.
+        if not self.footprintStatistics.contains(self.footprint):
+            return None
+
         # Prevent structure from burying itself underground
-        if self.localHeightMapBaseLine.max() + self.structure.groundClearance > self.structure.y:
+        if self.footprintStatistics.getMax('baseLine', self.footprint) + self.structure.groundClearance > \
+                self.structure.y:
             return None
 
         # Check if space is not already occupied by another structure
-        structureMapCropped = mapTools.getCroppedGrid(
-            grid=self.mapOfStructures,
-            globalOrigin=self.buildArea[:2],
-            globalCropOrigin=self.structure.getOriginInWorldSpace(),
-            globalCropFarCorner=self.structure.getFarCornerInWorldSpace()
-        )
-        if np.any(structureMapCropped > 0):
+        if self.footprintStatistics.isOccupied(self.footprint):
             return None
 
         # Calculate height difference
-        elevationFromOceanFloor = (self.structure.y - self.localHeightMapOceanFloor.mean())**3
+        elevationFromOceanFloor = (self.structure.y - self.footprintStatistics.getMean('oceanFloor', self.footprint))**3
         if self.isInDeepOcean:
             elevationFromOceanFloor = 0
 
@@ -127,22 +142,18 @@ class Node:
                     self.chosenPostProcessingSteps.append(self._pickDecorations(operations['decorations']))
                     continue
 
-    # Set map of structures to a constant to indicate something is already been built here.
-    def _updateMapOfStructures(self, structure: Structure):
-        localOrigin, localFarCorner = mapTools.getCrop(
-            globalOrigin=self.buildArea[:2],
-            globalCropOrigin=structure.getOriginInWorldSpace(),
-            globalCropFarCorner=structure.getFarCornerInWorldSpace()
-        )
-        self.mapOfStructures[
-            localOrigin[0]:localFarCorner[0],
-            localOrigin[1]:localFarCorner[1]
-        ] = 1
-
     def _doPreProcessing(self):
         # Clear out trees
         fromPos = np.add(self.structure.getOriginInWorldSpace(), 2)
         toPos = np.add(self.structure.getFarCornerInWorldSpace(), [2, 20, 2])
+
+        # Skip clearing when there are no trees or plants above the ground in the area.
+        if self.terrainAnalysis is not None and not self.terrainAnalysis.hasVegetation((
+            fromPos[0] - self.buildArea[0], fromPos[2] - self.buildArea[1],
+            toPos[0] - self.buildArea[0] + 1, toPos[2] - self.buildArea[1] + 1
+        )):
+            return
+
         for treeMaterial in TREES:
             mapTools.replace(*fromPos, *toPos, materialToReplace=treeMaterial)
 
@@ -187,6 +198,11 @@ class Node:
                 pillarPosition[0], groundLevel, pillarPosition[2],
                 pillar.get('material')
             )
+            self.worldState.commitFill(
+                *pillarPosition,
+                pillarPosition[0], groundLevel, pillarPosition[2],
+                pillar.get('material')
+            )
 
             if self.isInDeepOcean:
                 mapTools.fill(
@@ -214,6 +230,12 @@ class Node:
                     'facing': Structure.ROTATIONS[ladderRotation]
                 }
             )
+        if groundLevel < self.structure.y:
+            self.worldState.commitFill(
+                ladderPosition[0], groundLevel, ladderPosition[2],
+                ladderPosition[0], self.structure.y - 1, ladderPosition[2],
+                'ladder'
+            )
 
     # Place decoration structures post-processing function.
     def _pickDecorations(self, decorations):
@@ -372,19 +394,22 @@ class Node:
                 decorationStructure.replaceMaterial('minecraft:red_tulip', self.rng.choice(FARMLANDPLANTS))
 
         decorationStructure.place()
+        self.worldState.commitStructure(decorationStructure, isOccupying=False)
 
     # Place transition structure.
     # This is a structure inserted inside of the node's structure to create a transition (eg. a doorway) to the next
     # structure. These transition structures should have the same dimensions as the Node structure.
     # Use minecraft:structure_void blocks in the transition structure to prevent replacing the entire node structure.
     def _placeTransitionStructure(self, structureFile, facing):
-        Structure(
+        transitionStructure = Structure(
             structurePrototype=self.structure.prototype.transitionStructures[structureFile],
             rotation=facing,
             x=self.structure.x,
             y=self.structure.y,
             z=self.structure.z
-        ).place()
+        )
+        transitionStructure.place()
+        self.worldState.commitStructure(transitionStructure, isOccupying=False)
 
     def _chooseNextStructure(self, placementScores):
         if placementScores is None or len(placementScores) == 0:
@@ -401,75 +426,78 @@ class Node:
 
     def place(self, isStartingNode=False):
 
-        self._doPreProcessing()
+        # Coalesce the node's structure with its transition structures and decorations before sending.
+        with interface.deferredSending():
+            self._doPreProcessing()
 
-        self.structure.place()
-        self._updateMapOfStructures(self.structure)
+            self.structure.place()
+            self.worldState.commitStructure(self.structure)
 
-        self._doPostProcessing()
+            self._doPostProcessing()
 
-        selfRotation = self.structure.rotation
-        nextNodes = []
-        for connection in self.connectors:
+            selfRotation = self.structure.rotation
+            nextNodes = []
+            for connection in self.connectors:
 
-            connectionRotation = (connection.get('facing') + selfRotation) % 4
+                connectionRotation = (connection.get('facing') + selfRotation) % 4
 
-            isPreviousDirection = False
-            placementScores = dict()
-            nextNodeCandidates = dict()
+                isPreviousDirection = False
+                placementScores = dict()
+                nextNodeCandidates = dict()
 
-            if isStartingNode is False and (connection.get('facing') + selfRotation + 2) % 4 == selfRotation:
-                isPreviousDirection = True
-            elif isinstance(connection.get('nextStructure'), list):
+                if isStartingNode is False and (connection.get('facing') + selfRotation + 2) % 4 == selfRotation:
+                    isPreviousDirection = True
+                elif isinstance(connection.get('nextStructure'), list):
 
-                nextStructureNameList = copy.copy(connection.get('nextStructure'))
-                self.rng.shuffle(nextStructureNameList)
+                    nextStructureNameList = copy.copy(connection.get('nextStructure'))
+                    self.rng.shuffle(nextStructureNameList)
 
-                for nextStructureName in nextStructureNameList:
-                    if nextStructureName not in globals.structurePrototypes:
-                        continue
+                    for nextStructureName in nextStructureNameList:
+                        if nextStructureName not in globals.structurePrototypes:
+                            continue
 
-                    nextStructure = globals.structurePrototypes[nextStructureName]
-
-                    # Determine height of next node.
-                    nextHeight = self.structure.y
-                    if connection.get('height'):
-                        nextHeight = self.structure.y + connection.get('height')
-
-                    # Construct node and evaluate placement score
-                    nextNodeCandidates[nextStructureName] = Node(
-                        nodeStructurePrototype=nextStructure,
-                        facing=connectionRotation,
-                        y=nextHeight,
-                        parentStructure=self.structure,
-                        buildArea=self.buildArea,
-                        mapOfStructures=self.mapOfStructures,
-                        rng=self.rng,
-                        baseLineHeightMap=self.baseLineHeightMap,
-                        oceanFloorHeightMap=self.oceanFloorHeightMap,
-                        worldSlice=self.worldSlice
-                    )
-                    placementCost = nextNodeCandidates[nextStructureName].getPlacementCost()
-                    if placementCost is not None:
-                        placementScores[nextStructureName] = placementCost
-
-            # Select next node based on which has the lowest placement cost.
-            # TODO have placement looking 2 step into the future with MCTS
-            nextNodeStructureName = self._chooseNextStructure(placementScores)
-            nextNode = nextNodeCandidates.get(nextNodeStructureName)
-
-            # Build transition piece
-            if connection.get('transitionStructure'):
-                # Only when it transitioning in the previous direction
-                # OR to transition to the next node, as long this is placable.
-                if isPreviousDirection or nextNode:
-                    self._placeTransitionStructure(connection.get('transitionStructure'), connectionRotation)
-
-            if nextNode:
-                globals.constructionBudget -= placementScores[nextNodeStructureName]
-                print('remaining construction budget: %s after placing %s (cost: %s)' % (
-                    globals.constructionBudget, nextNodeStructureName, placementScores[nextNodeStructureName]
-                ))
-                nextNodes.append(nextNode)
+                        nextStructure = globals.structurePrototypes[nextStructureName]
+
+                        # Determine height of next node.
+                        nextHeight = self.structure.y
+                        if connection.get('height'):
+                            nextHeight = self.structure.y + connection.get('height')
+
+                        # Construct node and evaluate placement score
+                        nextNodeCandidates[nextStructureName] = Node(
+                            nodeStructurePrototype=nextStructure,
+                            facing=connectionRotation,
+                            y=nextHeight,
+                            parentStructure=self.structure,
+                            buildArea=self.buildArea,
+                            rng=self.rng,
+                            baseLineHeightMap=self.baseLineHeightMap,
+                            oceanFloorHeightMap=self.oceanFloorHeightMap,
+                            worldSlice=self.worldSlice,
+                            worldState=self.worldState,
+                            terrainAnalysis=self.terrainAnalysis
+                        )
+                        placementCost = nextNodeCandidates[nextStructureName].getPlacementCost()
+                        if placementCost is not None:
+                            placementScores[nextStructureName] = placementCost
+
+                # Select next node based on which has the lowest placement cost.
+                # TODO have placement looking 2 step into the future with MCTS
+                nextNodeStructureName = self._chooseNextStructure(placementScores)
+                nextNode = nextNodeCandidates.get(nextNodeStructureName)
+
+                # Build transition piece
+                if connection.get('transitionStructure'):
+                    # Only when it transitioning in the previous direction
+                    # OR to transition to the next node, as long this is placable.
+                    if isPreviousDirection or nextNode:
+                        self._placeTransitionStructure(connection.get('transitionStructure'), connectionRotation)
+
+                if nextNode:
+                    globals.constructionBudget -= placementScores[nextNodeStructureName]
+                    print('remaining construction budget: %s after placing %s (cost: %s)' % (
+                        globals.constructionBudget, nextNodeStructureName, placementScores[nextNodeStructureName]
+                    ))
+                    nextNodes.append(nextNode)
         for nextNode in nextNodes:
             nextNode.place()
@@ -0,0 +1,92 @@
+import numpy as np
+import globals
+from FootprintStatistics import FootprintStatistics
+from StructurePrototype import StructurePrototype
+from materials import BIOMES, DEEPOCEANBIOMES
+from worldLoader import WorldSlice
+
+# Feasibility and placement cost of a structure prototype at every position of the build area at once.
+#
+# The maps follow the same rules as Node.getPlacementCost, evaluated for every footprint with NumPy instead of one node
+# at a time. They are indexed by the position of the node in local build area coordinates, which is the near corner of
+# the footprint unless the prototype has an offset. The cost of decorations is not included, as those are only picked
+# once a node is created. Rotating a structure does not change its footprint in this generator, so one map covers every
+# rotation of a prototype.
+
+DEEPOCEANBIOMEIDS = [biomeId for biomeId, biomeName in BIOMES.items() if biomeName in DEEPOCEANBIOMES]
+
+
+class PlacementMap:
+
+    def __init__(self,
+                 structurePrototype: StructurePrototype,
+                 footprintStatistics: FootprintStatistics,
+                 heightMap=np.array([]),
+                 mask=None,
+                 buildArea=(0, 0, 0, 0),
+                 worldSlice: WorldSlice = None
+                 ):
+        self.prototype = structurePrototype
+        self.sizeX = structurePrototype.getSizeX()
+        self.sizeZ = structurePrototype.getSizeZ()
+        self.offset = structurePrototype.customProperties.get('offset', [0, 0, 0])
+
+        # Height of the node at each position and where it may be placed at all, in the shape of
+        # footprintStatistics.getMaxMap for the size of the structure.
+        self.heightMap = heightMap
+        if mask is None:
+            mask = np.full(heightMap.shape, True)
+        structureHeightMap = heightMap + self.offset[1]
+
+        # Footprints moved outside of the build area by the offset can not be placed.
+        isInside = self._offsetMap(np.full(heightMap.shape, True), False)
+
+        # Prevent structure from burying itself underground
+        maxBaseLine = self._offsetMap(footprintStatistics.getMaxMap('baseLine', self.sizeX, self.sizeZ), 0)
+        isAboveGround = maxBaseLine + structurePrototype.groundClearance <= structureHeightMap
+
+        # Check if space is not already occupied by another structure
+        isUnoccupied = self._offsetMap(footprintStatistics.getOccupiedCountMap(self.sizeX, self.sizeZ), 0) == 0
+
+        # Calculate height difference, which does not count in deep ocean biomes.
+        meanOceanFloor = self._offsetMap(footprintStatistics.getMeanMap('oceanFloor', self.sizeX, self.sizeZ), 0)
+        elevationFromOceanFloor = (structureHeightMap - meanOceanFloor)**3
+        if worldSlice is not None:
+            originXs, originZs = np.indices(heightMap.shape)
+            biomeIds = worldSlice.getBiomeIds(
+                originXs + self.offset[0] + buildArea[0],
+                structureHeightMap,
+                originZs + self.offset[2] + buildArea[1]
+            )
+            elevationFromOceanFloor[np.isin(biomeIds, DEEPOCEANBIOMEIDS)] = 0
+
+        self.placementCost = structurePrototype.cost + elevationFromOceanFloor
+        self.feasible = mask & isInside & isAboveGround & isUnoccupied \
+            & (self.placementCost <= globals.constructionBudget)
+
+    # Move a map indexed by footprint to the positions of the nodes, filling in positions whose footprint is outside.
+    def _offsetMap(self, grid, fillValue):
+        offsetX, offsetZ = self.offset[0], self.offset[2]
+        result = np.full(grid.shape, fillValue, dtype=grid.dtype)
+        result[
+            max(-offsetX, 0):grid.shape[0] - max(offsetX, 0),
+            max(-offsetZ, 0):grid.shape[1] - max(offsetZ, 0)
+        ] = grid[
+            max(offsetX, 0):grid.shape[0] + min(offsetX, 0),
+            max(offsetZ, 0):grid.shape[1] + min(offsetZ, 0)
+        ]
+        return result
+
+    def getFeasiblePositions(self):
+        return np.argwhere(self.feasible)
+
+    # Exclude a position after all, eg. when the decorations of a node placed there exceed the construction budget.
+    def reject(self, x, z):
+        self.feasible[x, z] = False
+
+    # Pick a random feasible position, None if there is none.
+    def pickPosition(self, rng):
+        positions = self.getFeasiblePositions()
+        if len(positions) == 0:
+            return None
+        return positions[rng.integers(len(positions))]
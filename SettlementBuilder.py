@@ -1,21 +1,30 @@
 import numpy as np
+import interface
 import mapTools
 from Node import Node
+from PlacementMap import PlacementMap
+from TerrainAnalysis import TerrainAnalysis
+from WorldState import WorldState
 import globals
 import StructurePrototype
 
 
 class SettlementBuilder:
 
-    def __init__(self):
+    def __init__(self, seed=None, skipUnchangedBlocks=False):
 
         # DEBUG
         # central RNG generator
-        self.rng = np.random.default_rng()
+        self.rng = np.random.default_rng(seed)
 
         # /setbuildarea ~ ~ ~ ~32 ~12 ~32
         self.buildArea, worldSlice = mapTools.getBuildArea()
 
+        # Don't send blocks which are already present in the world. Only safe when worldSlice describes the world as it
+        # is now, so it is opt-in.
+        if skipUnchangedBlocks:
+            interface.setDiffWorldSlice(worldSlice)
+
         globals.constructionBudget = 3400
 
         primaryColor = self.rng.choice(('orange', 'magenta', 'light_blue', 'yellow', 'lime', 'pink',
@@ -50,17 +59,34 @@ class SettlementBuilder:
         #     'minecraft:orange_wool'
         # )
 
-        # Map of structures built in the build area.
-        mapOfStructures = np.full(shape=self.baseLineHeightMap.shape, fill_value=0)
+        # Height maps and map of structures of the settlement as it is built, shared by all nodes.
+        worldState = WorldState(self.buildArea, self.baseLineHeightMap, self.oceanFloorHeightMap)
+
+        # Terrain layers derived from the height maps, computed when first needed.
+        terrainAnalysis = TerrainAnalysis(
+            worldSlice=worldSlice,
+            buildArea=self.buildArea,
+            baseLineHeightMap=self.baseLineHeightMap,
+            oceanFloorHeightMap=self.oceanFloorHeightMap,
+            worldSurfaceHeightMap=worldSurfaceHeightMap
+        )
 
         startingStructure: StructurePrototype = globals.structurePrototypes['hub7']
 
+        # Pick starting positions from the positions where the starting structure fits.
+        startPlacementMap = self.getStartPlacementMap(
+            startingStructure, worldState.footprintStatistics, worldSlice
+        )
+
         maxPlacementAttempts = 100
         placementTryCount = 0
         firstPlacement = None
         while placementTryCount < maxPlacementAttempts:
 
-            startingPos = self.getStartPosition(startingStructure)
+            startingPos = self.getStartPosition(startPlacementMap)
+            if startingPos is None:
+                print('No room for starting structure %s' % startingStructure.structureName)
+                break
 
             startingNode = Node(
                 x=startingPos[0],
@@ -71,7 +97,8 @@ class SettlementBuilder:
                 worldSlice=worldSlice,
                 baseLineHeightMap=self.baseLineHeightMap,
                 oceanFloorHeightMap=self.oceanFloorHeightMap,
-                mapOfStructures=mapOfStructures,
+                worldState=worldState,
+                terrainAnalysis=terrainAnalysis,
                 nodeStructurePrototype=startingStructure,
                 rng=self.rng
             )
@@ -85,6 +112,8 @@ class SettlementBuilder:
                 firstPlacement = startingNode
                 break
             else:
+                # Only the cost of the decorations picked for the node can make it fail here.
+                startPlacementMap.reject(startingPos[0] - self.buildArea[0], startingPos[2] - self.buildArea[1])
                 placementTryCount = placementTryCount + 1
 
         if firstPlacement:
@@ -111,17 +140,42 @@ class SettlementBuilder:
                 })
             )
 
-    def getStartPosition(self, startingStructure):
-        # Pick starting position somewhere in the middle of the build area
+    # Map of where the starting structure can be placed somewhere in the middle of the build area, at the height of the
+    # base line next to it.
+    def getStartPlacementMap(self, startingStructure, footprintStatistics, worldSlice):
         structureSize = startingStructure.getLongestHorizontalSize()
-        pos = (
-            self.rng.integers(low=structureSize, high=self.buildArea[2] - structureSize),
-            0,
-            self.rng.integers(low=structureSize, high=self.buildArea[3] - structureSize)
+        sampleXs = np.arange(structureSize, self.buildArea[2] - structureSize)
+        sampleZs = np.arange(structureSize, self.buildArea[3] - structureSize)
+        originXs = sampleXs + int(startingStructure.getSizeX() / 2)
+        originZs = sampleZs + int(startingStructure.getSizeZ() / 2)
+
+        originMapShape = footprintStatistics.getMaxMap(
+            'baseLine', startingStructure.getSizeX(), startingStructure.getSizeZ()
+        ).shape
+        isInsideX = originXs < originMapShape[0]
+        isInsideZ = originZs < originMapShape[1]
+        samples = np.ix_(sampleXs[isInsideX], sampleZs[isInsideZ])
+        origins = np.ix_(originXs[isInsideX], originZs[isInsideZ])
+
+        heightMap = np.zeros(originMapShape, dtype=int)
+        heightMap[origins] = self.baseLineHeightMap[samples] + startingStructure.groundClearance
+        mask = np.full(originMapShape, False)
+        mask[origins] = True
+        return PlacementMap(
+            structurePrototype=startingStructure,
+            footprintStatistics=footprintStatistics,
+            heightMap=heightMap,
+            mask=mask,
+            buildArea=self.buildArea,
+            worldSlice=worldSlice
         )
-        pos = (
-            pos[0] + self.buildArea[0] + int(startingStructure.getSizeX() / 2),
-            self.baseLineHeightMap[pos[0], pos[2]] + startingStructure.groundClearance,
-            pos[2] + self.buildArea[1] + int(startingStructure.getSizeZ() / 2)
+
+    def getStartPosition(self, startPlacementMap):
+        pos = startPlacementMap.pickPosition(self.rng)
+        if pos is None:
+            return None
+        return (
+            pos[0] + self.buildArea[0],
+            startPlacementMap.heightMap[pos[0], pos[1]],
+            pos[1] + self.buildArea[1]
         )
-        return pos
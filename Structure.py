@@ -235,6 +235,37 @@ class Structure:
         pivot = self.origin if not self.rotateAroundCenter else self.getHorizontalCenter()
         return mapTools.rotatePointAroundOrigin(pivot, currentPosition, self.rotation)
 
+    # Get the world positions and materials of the blocks this structure places, except for air.
+    def getPlacedBlocks(self):
+        positions = []
+        materials = []
+        stateMaterials = {}
+        for block in self.nbt["blocks"]:
+            state = block["state"].value
+            if state not in stateMaterials:
+                stateMaterials[state] = self.getBlockMaterial(block)
+            blockMaterial = stateMaterials[state]
+            if blockMaterial == 'minecraft:structure_void' or blockMaterial == 'minecraft:air':
+                continue
+            if block.tags[-1] == 'DO_NOT_PLACE':
+                continue
+            positions.append([block["pos"][0].value, block["pos"][1].value, block["pos"][2].value])
+            materials.append(blockMaterial)
+        positions = np.reshape(np.array(positions, dtype=int), (-1, 3))
+
+        # Rotate all positions at once the same way _applyRotation does.
+        if self.rotation != self.ROTATE_NORTH:
+            pivot = self.origin if not self.rotateAroundCenter else self.getHorizontalCenter()
+            angle = np.deg2rad(self.rotation * 90)
+            offsetX = positions[:, 0] - pivot[0]
+            offsetZ = positions[:, 2] - pivot[2]
+            positions = np.stack([
+                np.round(np.cos(angle) * offsetX - np.sin(angle) * offsetZ + pivot[0]).astype(int),
+                positions[:, 1],
+                np.round(np.sin(angle) * offsetX + np.cos(angle) * offsetZ + pivot[2]).astype(int)
+            ], axis=1)
+        return positions + [self.x, self.y, self.z], materials
+
     def markBlockAsUnplacable(self, block):
         block.tags.append('DO_NOT_PLACE')
 
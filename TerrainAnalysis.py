@@ -0,0 +1,101 @@
+import numpy as np
+from FootprintStatistics import FootprintStatistics
+from materials import SOILS, LIQUIDS, ARTIFICIAL
+from worldLoader import WorldSlice
+
+# Raster layers describing the terrain of the build area, derived from the height maps and the world slice.
+#
+# Every layer has the shape of the height maps and is computed with NumPy the first time it is requested, after which it
+# is cached. The height maps describe the terrain before the settlement is built.
+
+# Classes of the block at the surface of the terrain, indexed by the values of the surfaceMaterial layer.
+SURFACEMATERIALS = ('other', 'soil', 'liquid', 'artificial')
+
+# Size of the window over which the roughness layer is computed.
+ROUGHNESSWINDOW = 3
+
+
+class TerrainAnalysis:
+
+    def __init__(self,
+                 worldSlice: WorldSlice = None,
+                 buildArea=(0, 0, 0, 0),
+                 baseLineHeightMap=np.array([]),
+                 oceanFloorHeightMap=np.array([]),
+                 worldSurfaceHeightMap=np.array([]),
+                 footprintStatistics: FootprintStatistics = None
+                 ):
+        self.worldSlice = worldSlice
+        self.buildArea = buildArea
+        self.baseLineHeightMap = baseLineHeightMap
+        self.oceanFloorHeightMap = oceanFloorHeightMap
+        self.worldSurfaceHeightMap = worldSurfaceHeightMap
+        if footprintStatistics is None:
+            footprintStatistics = FootprintStatistics(
+                baseLineHeightMap, oceanFloorHeightMap, np.zeros(baseLineHeightMap.shape, dtype=int)
+            )
+        self.footprintStatistics = footprintStatistics
+
+        self.layers = {}
+        self.layerFunctions = {
+            'slope': self._calcSlope,
+            'waterDepth': self._calcWaterDepth,
+            'vegetationHeight': self._calcVegetationHeight,
+            'surfaceMaterial': self._calcSurfaceMaterial,
+            'biome': self._calcBiome,
+            'roughness': self._calcRoughness
+        }
+
+    def getLayer(self, layerName):
+        if layerName not in self.layers:
+            self.layers[layerName] = self.layerFunctions[layerName]()
+        return self.layers[layerName]
+
+    # Steepness of the base line in blocks per block.
+    def _calcSlope(self):
+        return np.hypot(*np.gradient(self.baseLineHeightMap.astype(float)))
+
+    # Depth of the water (or other liquid) above the ocean floor.
+    def _calcWaterDepth(self):
+        return np.maximum(self.baseLineHeightMap - self.oceanFloorHeightMap, 0)
+
+    # Height of trees and plants above the base line.
+    def _calcVegetationHeight(self):
+        return np.maximum(self.worldSurfaceHeightMap - self.baseLineHeightMap, 0)
+
+    # Class of the top block of the terrain below the base line, see SURFACEMATERIALS.
+    def _calcSurfaceMaterial(self):
+        xs, zs = self._getWorldCoordinates()
+        blockStateIds = self.worldSlice.getBlockIds(xs, self.baseLineHeightMap - 1, zs)
+        surfaceMaterial = np.zeros(self.baseLineHeightMap.shape, dtype=np.uint8)
+        for materialClass, materials in enumerate((SOILS, LIQUIDS, ARTIFICIAL), start=1):
+            # Look up the mask after reading the blocks, as reading them can add new block states to the palette.
+            surfaceMaterial[self.worldSlice.palette.getMask(materials)[blockStateIds]] = materialClass
+        return surfaceMaterial
+
+    # Biome id at the base line, worldLoader.UNKNOWNBIOME for the columns just outside of the world slice.
+    def _calcBiome(self):
+        xs, zs = self._getWorldCoordinates()
+        return self.worldSlice.getBiomeIds(xs, self.baseLineHeightMap, zs)
+
+    # Standard deviation of the base line around each column.
+    def _calcRoughness(self):
+        variance = self.footprintStatistics.getVarianceMap('baseLine', ROUGHNESSWINDOW, ROUGHNESSWINDOW)
+        return np.pad(np.sqrt(np.maximum(variance, 0)), ROUGHNESSWINDOW // 2, mode='edge')
+
+    def _getWorldCoordinates(self):
+        xs, zs = np.indices(self.baseLineHeightMap.shape)
+        return xs + self.buildArea[0], zs + self.buildArea[1]
+
+    # Standard deviation of the base line within a footprint, see FootprintStatistics.
+    def getRoughness(self, footprint):
+        return np.sqrt(max(self.footprintStatistics.getVariance('baseLine', footprint), 0))
+
+    # Whether there are trees or plants above the base line within a footprint. Footprints reaching outside of the
+    # height maps are assumed to have vegetation.
+    def hasVegetation(self, footprint):
+        x1, z1, x2, z2 = footprint
+        sizeX, sizeZ = self.baseLineHeightMap.shape
+        if not (0 <= x1 < x2 <= sizeX and 0 <= z1 < z2 <= sizeZ):
+            return True
+        return bool(np.any(self.getLayer('vegetationHeight')[x1:x2, z1:z2] > 0))
@@ -0,0 +1,85 @@
+import numpy as np
+import mapTools
+from FootprintStatistics import FootprintStatistics
+from Structure import Structure
+from materials import LIQUIDS
+
+# The build area as the settlement is being built.
+#
+# Keeps copies of the base line and ocean floor height maps and the map of structures, together with their footprint
+# statistics, and raises the height maps as structures, pillars and ladders are committed. Only the columns covered by
+# the committed blocks are changed, so the footprint statistics recompute just the tiles around them. The height maps
+# passed in keep describing the terrain before the settlement was built.
+
+# Materials which do not raise each height map, the same filters mapTools.calcHeightMap lowers them through.
+HEIGHTMAPFILTERS = {
+    'baseLine': set(mapTools.BLOCKFILTERS['trees']),
+    'oceanFloor': set(mapTools.BLOCKFILTERS['trees'] + LIQUIDS)
+}
+
+
+class WorldState:
+
+    def __init__(self,
+                 buildArea=(0, 0, 0, 0),
+                 baseLineHeightMap=np.array([]),
+                 oceanFloorHeightMap=np.array([]),
+                 mapOfStructures=None
+                 ):
+        self.buildArea = buildArea
+        self.baseLineHeightMap = np.array(baseLineHeightMap)
+        self.oceanFloorHeightMap = np.array(oceanFloorHeightMap)
+        if mapOfStructures is None:
+            mapOfStructures = np.full(shape=self.baseLineHeightMap.shape, fill_value=0)
+        self.mapOfStructures = np.array(mapOfStructures)
+        self.footprintStatistics = FootprintStatistics(
+            self.baseLineHeightMap, self.oceanFloorHeightMap, self.mapOfStructures
+        )
+
+    # Commit the blocks of a placed structure. Unless it is a decoration or transition inside of another structure,
+    # mark its footprint in the map of structures as well.
+    def commitStructure(self, structure: Structure, isOccupying=True):
+        if isOccupying:
+            localOrigin, localFarCorner = mapTools.getCrop(
+                globalOrigin=self.buildArea[:2],
+                globalCropOrigin=structure.getOriginInWorldSpace(),
+                globalCropFarCorner=structure.getFarCornerInWorldSpace()
+            )
+            self.footprintStatistics.markOccupied((*localOrigin, *localFarCorner))
+        self.commitBlocks(*structure.getPlacedBlocks())
+
+    # Commit a cuboid filled with a single material, such as a pillar or a ladder.
+    def commitFill(self, fromX, fromY, fromZ, toX, toY, toZ, material):
+        xs, zs = np.meshgrid(
+            np.arange(min(fromX, toX), max(fromX, toX) + 1),
+            np.arange(min(fromZ, toZ), max(fromZ, toZ) + 1),
+            indexing='ij'
+        )
+        positions = np.stack([xs.ravel(), np.full(xs.size, max(fromY, toY)), zs.ravel()], axis=1)
+        self.commitBlocks(positions, [material] * len(positions))
+
+    # Raise the height maps to just above the blocks at the given world positions.
+    def commitBlocks(self, positions, materials):
+        positions = np.reshape(positions, (-1, 3))
+        if len(positions) == 0:
+            return
+        xs = positions[:, 0] - self.buildArea[0]
+        ys = positions[:, 1]
+        zs = positions[:, 2] - self.buildArea[1]
+        # Look up each distinct material in the filters only once.
+        materialIds = {}
+        materialIndices = np.array([materialIds.setdefault(material, len(materialIds)) for material in materials])
+        namespacedMaterials = [material if ':' in material else 'minecraft:' + material for material in materialIds]
+        isInside = (xs >= 0) & (xs < self.baseLineHeightMap.shape[0]) \
+            & (zs >= 0) & (zs < self.baseLineHeightMap.shape[1])
+        for heightMapName, heightMapFilter in HEIGHTMAPFILTERS.items():
+            isFiltered = np.array([material in heightMapFilter for material in namespacedMaterials])
+            isCounted = isInside & ~isFiltered[materialIndices]
+            if not isCounted.any():
+                continue
+            footprint = (xs[isCounted].min(), zs[isCounted].min(), xs[isCounted].max() + 1, zs[isCounted].max() + 1)
+            heightMap = self.footprintStatistics.heightMaps[heightMapName]
+            heights = heightMap[footprint[0]:footprint[2], footprint[1]:footprint[3]].copy()
+            np.maximum.at(heights, (xs[isCounted] - footprint[0], zs[isCounted] - footprint[1]), ys[isCounted] + 1)
+            if not np.array_equal(heights, heightMap[footprint[0]:footprint[2], footprint[1]:footprint[3]]):
+                self.footprintStatistics.updateHeightMap(heightMapName, footprint, heights)
@@ -5,6 +5,8 @@ __version__ = 'v5.0'
 
 from math import floor
 
+import numpy as np
+
 
 def inclusiveBetween(start, end, value):
     """**Raise an exception when the value is out of bounds**."""
@@ -57,6 +59,17 @@ class BitArray:
         k = (index - i * self.entriesPerLong) * self.bitsPerEntry
         return j >> k & self.maxEntryValue
 
+    def toNumpy(self):
+        """**Return all values as a NumPy array, decoded in one vectorised pass**.
+
+        Values are unsigned, uint16 for up to 16 bits per entry and uint32
+        otherwise. Entries never span two longs, as in Minecraft 1.16.
+        """
+        longs = np.asarray(getattr(self.longArray, 'value', self.longArray), dtype=np.int64).view(np.uint64)
+        shifts = np.arange(self.entriesPerLong, dtype=np.uint64) * np.uint64(self.bitsPerEntry)
+        values = (longs[:, np.newaxis] >> shifts) & np.uint64(self.maxEntryValue)
+        return values.reshape(-1)[:self.arraySize].astype(np.uint16 if self.bitsPerEntry <= 16 else np.uint32)
+
     def size(self):
         """**Return self.arraySize**."""
         return self.arraySize
@@ -0,0 +1,137 @@
+# ! /usr/bin/python3
+"""### Keep decoded chunks on disk between runs.
+
+Every chunk is stored as an uncompressed `.npz` file holding the arrays
+returned by `worldLoader.decodeChunks`, with the sections still packed, so a
+warm `WorldSlice` needs neither HTTP requests nor NBT parsing. The cache is
+emptied when the state reported by the server (such as the world seed)
+differs from the state it was filled with, and the least recently used
+chunks are evicted once the cache grows beyond its size limit. Chunks
+written to through `interface` are discarded when its buffer is flushed.
+"""
+__all__ = ['ChunkCache']
+__version__ = "v1.0"
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+# Bump when the layout of the cached arrays changes.
+CACHEFORMAT = 2
+
+
+class ChunkCache:
+    """**Stores decoded chunks in a directory, keyed by chunk coordinates**."""
+
+    def __init__(self, directory='.chunkcache', maximumBytes=512 * 1024 * 1024, serverState=None):
+        """**Open or create the cache in directory**.
+
+        serverState is a JSON serialisable description of the world. When it
+        differs from the state of the cached chunks the cache is cleared.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.maximumBytes = maximumBytes
+        self.hits = 0
+        self.misses = 0
+        self.totalBytes = sum(path.stat().st_size for path in self.directory.glob('chunk.*.npz'))
+
+        state = {'format': CACHEFORMAT, 'server': serverState}
+        statePath = self.directory / 'state.json'
+        try:
+            with open(statePath) as stateFile:
+                cachedState = json.load(stateFile)
+        except (OSError, ValueError):
+            cachedState = None
+        if cachedState != state:
+            self.clear()
+            with open(statePath, 'w') as stateFile:
+                json.dump(state, stateFile)
+
+    def __repr__(self):
+        return f"ChunkCache({str(self.directory)!r})"
+
+    def _chunkPath(self, x, z):
+        return self.directory / 'chunk.{}.{}.npz'.format(x, z)
+
+    def load(self, x, z, heightmapTypes):
+        """**Return the decoded chunk at chunk coordinates x, z or None if it is not cached**.
+
+        The chunk is only returned if it has all the heightmaps in heightmapTypes.
+        """
+        path = self._chunkPath(x, z)
+        try:
+            with np.load(path) as data:
+                if not all('heightmap.' + hmName in data for hmName in heightmapTypes):
+                    self.misses += 1
+                    return None
+                heightmaps = {hmName: data['heightmap.' + hmName] for hmName in heightmapTypes}
+                palettes = json.loads(str(data['palettes']))
+                bitsPerEntry = data['sectionBits'].tolist()
+                # The packed sections are stored one after the other.
+                ends = np.cumsum([-(-16 * 16 * 16 // (64 // bits)) for bits in bitsPerEntry], dtype=int)
+                blockStates = np.split(data['blockStates'], ends[:-1])
+                sections = list(zip(data['sectionY'].tolist(), palettes, bitsPerEntry, blockStates))
+                biomes = data['biomes']
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        # Touch the file so eviction removes the least recently used chunks first.
+        os.utime(path)
+        self.hits += 1
+        return heightmaps, [(y, [tuple(entry) for entry in palette], bits, longs)
+                            for y, palette, bits, longs in sections], biomes
+
+    def store(self, x, z, chunk):
+        """**Write a chunk decoded by worldLoader.decodeChunks to the cache**."""
+        heightmaps, sections, biomes = chunk
+        arrays = {'heightmap.' + hmName: heightmap for hmName, heightmap in heightmaps.items()}
+        arrays['sectionY'] = np.array([section[0] for section in sections], dtype=np.int8)
+        arrays['palettes'] = np.array(json.dumps([section[1] for section in sections]))
+        arrays['sectionBits'] = np.array([section[2] for section in sections], dtype=np.uint8)
+        arrays['blockStates'] = np.concatenate([section[3] for section in sections]
+                                               + [np.zeros(0, dtype=np.int64)])
+        arrays['biomes'] = biomes
+
+        path = self._chunkPath(x, z)
+        temporaryPath = path.with_name(path.name + '.tmp')
+        with open(temporaryPath, 'wb') as chunkFile:
+            np.savez(chunkFile, **arrays)
+        if path.exists():
+            self.totalBytes -= path.stat().st_size
+        os.replace(temporaryPath, path)
+        self.totalBytes += path.stat().st_size
+        if self.totalBytes > self.maximumBytes:
+            self.evict(self.maximumBytes)
+
+    def discard(self, chunks):
+        """**Remove the chunks at the given chunk coordinates, such as chunks that have been written to**."""
+        for x, z in chunks:
+            path = self._chunkPath(x, z)
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except OSError:
+                continue
+            self.totalBytes -= size
+
+    def evict(self, maximumBytes):
+        """**Remove the least recently used chunks until the cache is at most maximumBytes**."""
+        paths = []
+        for path in self.directory.glob('chunk.*.npz'):
+            stat = path.stat()
+            paths.append((stat.st_mtime, stat.st_size, path))
+        paths.sort()
+        for _, size, path in paths:
+            if self.totalBytes <= maximumBytes:
+                break
+            path.unlink()
+            self.totalBytes -= size
+
+    def clear(self):
+        """**Remove every cached chunk**."""
+        for path in self.directory.glob('chunk.*.npz*'):
+            path.unlink()
+        self.totalBytes = 0
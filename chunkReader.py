@@ -0,0 +1,200 @@
+# ! /usr/bin/python3
+"""### Read the chunk data the generator needs straight from NBT bytes.
+
+Rather than building a tree of tag objects for the whole `/chunks` response,
+this module walks the binary NBT once, reads the heightmaps, the sections
+(palette and block states) and the biomes of every chunk into NumPy arrays
+and skips every other payload by its length.
+"""
+__all__ = ['readChunks']
+__version__ = "v1.0"
+
+import struct
+from math import ceil, log2
+
+import numpy as np
+
+from bitarray import BitArray
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+# Size in bytes of the payloads of fixed size and of the elements of array payloads.
+PAYLOADSIZES = {TAG_BYTE: 1, TAG_SHORT: 2, TAG_INT: 4, TAG_LONG: 8, TAG_FLOAT: 4, TAG_DOUBLE: 8}
+ELEMENTSIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+
+
+class _TagReader:
+    """**Reads NBT payloads from a buffer without creating tag objects**."""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def readByte(self):
+        value = struct.unpack_from('>b', self.data, self.position)[0]
+        self.position += 1
+        return value
+
+    def readInt(self):
+        value = struct.unpack_from('>i', self.data, self.position)[0]
+        self.position += 4
+        return value
+
+    def readString(self):
+        length = struct.unpack_from('>H', self.data, self.position)[0]
+        self.position += 2 + length
+        return bytes(self.data[self.position - length:self.position]).decode('utf-8')
+
+    def readArray(self, dtype):
+        """**Read an int or long array payload into a native NumPy array**."""
+        length = self.readInt()
+        values = np.frombuffer(self.data, dtype=dtype, count=length, offset=self.position)
+        self.position += length * values.itemsize
+        return values.astype(values.dtype.newbyteorder('='))
+
+    def readListHeader(self):
+        """**Read the element type and length of a list payload**."""
+        elementType = self.data[self.position]
+        self.position += 1
+        return elementType, self.readInt()
+
+    def readCompound(self):
+        """**Iterate over the (type, name) of each tag in a compound payload**.
+
+        The payload of every tag has to be read or skipped before the next
+        tag is read.
+        """
+        while True:
+            tagType = self.data[self.position]
+            self.position += 1
+            if tagType == TAG_END:
+                return
+            yield tagType, self.readString()
+
+    def skip(self, tagType):
+        """**Skip a payload of the given type**."""
+        if tagType in PAYLOADSIZES:
+            self.position += PAYLOADSIZES[tagType]
+        elif tagType in ELEMENTSIZES:
+            self.position += 4 + self.readInt() * ELEMENTSIZES[tagType]
+        elif tagType == TAG_STRING:
+            self.position += 2 + struct.unpack_from('>H', self.data, self.position)[0]
+        elif tagType == TAG_LIST:
+            elementType, length = self.readListHeader()
+            if elementType in PAYLOADSIZES:
+                self.position += length * PAYLOADSIZES[elementType]
+            else:
+                for _ in range(length):
+                    self.skip(elementType)
+        elif tagType == TAG_COMPOUND:
+            for childType, _ in self.readCompound():
+                self.skip(childType)
+        else:
+            raise ValueError(f"Unknown NBT tag type {tagType} at byte {self.position}")
+
+
+def readChunks(chunkBytes, heightmapTypes, readSections=True):
+    """**Read the chunks of a /chunks response**.
+
+    Returns a (heightmaps, sections, biomes) tuple for every chunk, in the
+    same form as worldLoader.decodeChunks. The sections are skipped and
+    left empty if readSections is False.
+    """
+    reader = _TagReader(chunkBytes)
+    if reader.readByte() != TAG_COMPOUND:
+        raise ValueError("The chunk data does not start with a compound tag")
+    reader.readString()
+
+    chunks = []
+    for tagType, name in reader.readCompound():
+        if name == 'Chunks' and tagType == TAG_LIST:
+            _, length = reader.readListHeader()
+            for _ in range(length):
+                chunks.append(_readChunk(reader, heightmapTypes, readSections))
+        else:
+            reader.skip(tagType)
+    return chunks
+
+
+def _readChunk(reader, heightmapTypes, readSections):
+    heightmaps = {}
+    sections = []
+    biomes = np.zeros(0, dtype=np.int32)
+    for tagType, name in reader.readCompound():
+        if name != 'Level' or tagType != TAG_COMPOUND:
+            reader.skip(tagType)
+            continue
+        for levelTagType, levelName in reader.readCompound():
+            if levelName == 'Heightmaps' and levelTagType == TAG_COMPOUND:
+                for hmTagType, hmName in reader.readCompound():
+                    if hmName in heightmapTypes and hmTagType == TAG_LONG_ARRAY:
+                        # Heightmaps are stored in z, x order.
+                        heightmapValues = BitArray(9, 16 * 16, reader.readArray('>i8')).toNumpy()
+                        heightmaps[hmName] = heightmapValues.reshape((16, 16)).T
+                    else:
+                        reader.skip(hmTagType)
+            elif levelName == 'Sections' and levelTagType == TAG_LIST and readSections:
+                _, length = reader.readListHeader()
+                for _ in range(length):
+                    section = _readSection(reader)
+                    if section is not None:
+                        sections.append(section)
+            elif levelName == 'Biomes' and levelTagType == TAG_INT_ARRAY:
+                biomes = reader.readArray('>i4')
+            else:
+                reader.skip(levelTagType)
+    missingHeightmaps = set(heightmapTypes) - heightmaps.keys()
+    if missingHeightmaps:
+        raise KeyError(f"Chunk is missing the heightmaps {sorted(missingHeightmaps)}")
+    return heightmaps, sections, biomes
+
+
+def _readSection(reader):
+    """**Read a section, returns None for sections without block states**."""
+    y = 0
+    palette = []
+    blockStates = None
+    for tagType, name in reader.readCompound():
+        if name == 'Y' and tagType == TAG_BYTE:
+            y = reader.readByte()
+        elif name == 'Palette' and tagType == TAG_LIST:
+            _, length = reader.readListHeader()
+            for _ in range(length):
+                palette.append(_readPaletteEntry(reader))
+        elif name == 'BlockStates' and tagType == TAG_LONG_ARRAY:
+            blockStates = reader.readArray('>i8')
+        else:
+            reader.skip(tagType)
+    if blockStates is None or len(blockStates) == 0:
+        return None
+    return y, palette, max(4, ceil(log2(len(palette)))), blockStates
+
+
+def _readPaletteEntry(reader):
+    name = None
+    properties = None
+    for tagType, tagName in reader.readCompound():
+        if tagName == 'Name' and tagType == TAG_STRING:
+            name = reader.readString()
+        elif tagName == 'Properties' and tagType == TAG_COMPOUND:
+            properties = {}
+            for propertyType, propertyName in reader.readCompound():
+                if propertyType == TAG_STRING:
+                    properties[propertyName] = reader.readString()
+                else:
+                    reader.skip(propertyType)
+        else:
+            reader.skip(tagType)
+    return name, properties
@@ -7,22 +7,47 @@ This module contains functions to:
 * Get the name of a block at a particular coordinate
 * Place blocks in the world
 """
-__all__ = ['requestBuildArea', 'runCommand',
+__all__ = ['requestBuildArea', 'requestWorldSeed', 'runCommand',
            'setBlock', 'getBlock',
-           '_placeBlockBatched', 'sendBlocks']
+           '_placeBlockBatched', 'sendBlocks',
+           'setMaxConcurrentRequests', 'flush', 'join',
+           'AdaptiveBatchSize', 'getTransportMetrics', 'setHost',
+           'deferredSending', 'openJournal', 'closeJournal', 'resumeJournal',
+           'setDiffWorldSlice', 'startSenderThread', 'stopSenderThread']
 # __version__
 
+import json
+import queue
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
 
+# Address of the GDMC HTTP interface.
+host = 'http://localhost:9000'
+
+# Maximum number of block requests that may be in flight at the same time.
+maxConcurrentRequests = 4
+
 session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=maxConcurrentRequests))
+
+
+def setHost(url):
+    """**Sets the address of the HTTP interface all requests are sent to.**"""
+    global host
+    join()
+    host = url.rstrip('/')
 
 
 def requestBuildArea():
     """**Requests a build area and returns it as an dictionary containing 
     the keys xFrom, yFrom, zFrom, xTo, yTo and zTo**"""
-    response = session.get('http://localhost:9000/buildarea')
+    response = session.get(f'{host}/buildarea')
     if response.ok:
         return response.json()
     else:
@@ -30,21 +55,59 @@ def requestBuildArea():
         return -1
 
 
+def requestWorldSeed():
+    """**Requests the seed of the world, returns None if the server did not report one.**"""
+    match = re.search(r'\[(-?\d+)\]', _postCommand('seed'))
+    return match.group(1) if match else None
+
+
 def getChunks(x, z, dx, dz):
-    url = f'http://localhost:9000/chunks?x={x}&z={z}&dx={dx}&dz={dz}'
-    response = requests.get(url, headers={"Accept": 'application/octet-stream'})
+    url = f'{host}/chunks?x={x}&z={z}&dx={dx}&dz={dz}'
+    response = session.get(url, headers={"Accept": 'application/octet-stream'})
     if response.status_code >= 400:
         print(f"Error: {response.text}")
     return response.content
 
 
 def runCommand(command):
-    """**Executes one or multiple minecraft commands (separated by newlines).**"""
-    url = 'http://localhost:9000/command'
+    """**Executes one or multiple minecraft commands (separated by newlines).**
+
+    Waits for all block requests in flight to finish first, so commands
+    always act on a world that contains every block sent before them.
+    """
+    join()
+    if diffWorldSlice is not None:
+        _markCommandRegions(command)
+    return _sendCommand(_writeJournal('POST', '/command', command), command)
+
+
+def _sendCommand(entryId, command):
+    """**Executes journaled commands and acknowledges them once they have been run.**"""
+    if failedRequestCount > 0:
+        _markRequestFailed()
+        return "connection error"
+    response = _postCommand(command)
+    if response == "connection error":
+        _markRequestFailed()
+    else:
+        _acknowledgeJournal(entryId)
+    return response
+
+
+def _postCommand(command):
+    """**Executes commands without waiting for block requests in flight.**
+
+    Returns "connection error" if the server could not be reached or
+    answered with an HTTP error.
+    """
+    url = f'{host}/command'
     try:
         response = session.post(url, bytes(command, "utf-8"))
     except ConnectionError:
         return "connection error"
+    if not response.ok:
+        print(f"Command request failed: {response.status_code} - {response.text}")
+        return "connection error"
     return response.text
 
 # --------------------------------------------------------- get/set block
@@ -52,7 +115,8 @@ def runCommand(command):
 
 def getBlock(x, y, z):
     """**Returns the namespaced id of a block in the world.**"""
-    url = f'http://localhost:9000/blocks?x={x}&y={y}&z={z}'
+    join()
+    url = f'{host}/blocks?x={x}&y={y}&z={z}'
     # print(url)
     try:
         response = session.get(url)
@@ -75,62 +139,774 @@ def setBlock(x, y, z, material, properties, blockData, isBatched=True):
     if isBatched:
         return _placeBlockBatched(x, y, z, material, serialisedProperties, serialisedBlockData)
     """**Places a block in the world.**"""
-    url = f'http://localhost:9000/blocks?x={x}&y={y}&z={z}'
-    try:
-        response = session.put(url, material + serialisedProperties + serialisedBlockData)
-    except ConnectionError:
-        return "0"
-    print("{}, {}, {}: {} - {}".format(x, y, z, response.status_code, response.text))
-    return response.text
+    join()
+    # Sent like a buffered block, so it is journaled and its block data is written with a data merge command.
+    position = (int(x), int(y), int(z))
+    if diffWorldSlice is not None:
+        modifiedPositions.add(position)
+    path = '/blocks?x={}&y={}&z={}'.format(*position)
+    body = '~0 ~0 ~0 {}{}'.format(material, serialisedProperties)
+    commands = []
+    if serialisedBlockData != '{}':
+        commands.append('data merge block {} {} {} {}'.format(*position, serialisedBlockData))
+    response = _putBlocks(_writeJournal('PUT', path, body, commands), path, body, 1, commands, 5)
+    return "0" if response is None else response
 
 
 # --------------------------------------------------------- block buffers
 
-blockBuffer = []
+# Buffered blocks keyed by position, a later write to a position replaces the earlier unsent one.
+blockBuffer = {}
+# Commands writing block entity data for the blocks in the buffer, keyed by position.
+blockEntityBuffer = {}
+
+# Maximum number of block entity commands sent in a single command request.
+maxCommandsPerRequest = 100
 
+# While larger than 0, buffered blocks are held back until the outermost deferredSending block ends.
+deferDepth = 0
 
-def _placeBlockBatched(x, y, z, material, properties, blockData, limit=50):
-    """**Place a block in the buffer and send if the limit is exceeded.**"""
+
+def _placeBlockBatched(x, y, z, material, properties, blockData, limit=None):
+    """**Place a block in the buffer and send if the limit is exceeded.**
+
+    Without an explicit limit the buffer is sent once it reaches the size
+    picked by `batchSize`.
+    """
     _registerSetBlock(x, y, z, material, properties, blockData)
+    if limit is None:
+        limit = batchSize.size
     if len(blockBuffer) >= limit:
         return sendBlocks(0, 0, 0)
     else:
         return None
 
 
+@contextmanager
+def deferredSending():
+    """**Holds back buffered blocks until the end of the block, then sends them.**
+
+    Every block placed inside it is coalesced with later writes to the same
+    position before anything goes over the wire, eg. a structure with the
+    transition structures and decorations placed on top of it.
+    """
+    global deferDepth
+    deferDepth += 1
+    try:
+        yield
+    finally:
+        deferDepth -= 1
+        if deferDepth == 0:
+            sendBlocks()
+
+
 def sendBlocks(x=0, y=0, z=0, retries=5):
-    """**Sends the buffer to the server and clears it.**"""
-    global blockBuffer
-    body = str.join("\n", ['~{} ~{} ~{} {}{}'.format(*bp) for bp in blockBuffer])
-    # version with space for block data object
-    # body = str.join("\n", ['~{} ~{} ~{} {}{}{}'.format(*bp) for bp in blockBuffer])
-    url = f'http://localhost:9000/blocks?x={x}&y={y}&z={z}'
+    """**Sends the buffer to the server in the background and clears it.**
+
+    Boxes of identical blocks are sent as fill commands, all other blocks
+    are placed with block requests. Returns a future resolving to the server
+    response of the last request, or None when the buffer is handed to the
+    sender thread. Call `flush()` to wait for all blocks to be placed.
+    """
+    if deferDepth > 0 or len(blockBuffer) == 0:
+        return None
+    buffered = (blockBuffer, blockEntityBuffer, x, y, z, retries)
+    clearBlockBuffer()
+
+    if senderThread is not None:
+        _raiseSenderError()
+        # Blocks the generator while the queue is full, so it cannot run too far ahead of the server.
+        sendQueue.put(buffered)
+        return None
+    return _emitBlocks(*buffered)
+
+
+def _emitBlocks(bufferedBlocks, blockEntityCommands, x, y, z, retries):
+    """**Turns a buffer into requests and puts them on the request pipeline.**"""
+    blocks = [position + block for position, block in bufferedBlocks.items()]
+
+    if diffWorldSlice is not None:
+        blocks = _dropUnchangedBlocks(blocks, x, y, z)
+
+    future = None
+    if minimumFillVolume > 0:
+        blocks, cuboids = _mergeCuboids(blocks)
+        for i in range(0, len(cuboids), maxCommandsPerRequest):
+            batch = cuboids[i:i + maxCommandsPerRequest]
+            commands = str.join("\n", ['fill {} {} {} {} {} {} {}{}'.format(
+                cuboid[0] + x, cuboid[1] + y, cuboid[2] + z,
+                cuboid[3] + x, cuboid[4] + y, cuboid[5] + z,
+                *cuboid[6:8]
+            ) for cuboid in batch])
+            positions = frozenset().union(*[cuboid[8] for cuboid in batch])
+            entryId = _writeJournal('POST', '/command', commands)
+            future = _submitRequest(positions, _fillBlocks, entryId, commands, len(batch), len(positions))
+
+    path = f'/blocks?x={x}&y={y}&z={z}'
+    size = batchSize.size
+    for i in range(0, len(blocks), size):
+        batch = blocks[i:i + size]
+        positions = frozenset(bp[:3] for bp in batch)
+        batchCommands = []
+        if blockEntityCommands:
+            batchCommands = [blockEntityCommands[position] for position in positions if position in blockEntityCommands]
+        body = str.join("\n", ['~{} ~{} ~{} {}{}'.format(*bp) for bp in batch])
+        # version with space for block data object
+        # body = str.join("\n", ['~{} ~{} ~{} {}{}{}'.format(*bp) for bp in batch])
+        entryId = _writeJournal('PUT', path, body, batchCommands)
+        future = _submitRequest(positions, _putBlocks, entryId, path, body, len(batch), batchCommands, retries)
+    return future
+
+
+def _submitRequest(positions, function, *args):
+    """**Runs a request writing to the given positions on the request pipeline.**"""
+    # Blocks written to the same position must reach the server in the order they were placed.
+    for request in list(pendingRequests):
+        if not positions.isdisjoint(request[1]):
+            request[0].result()
+    _pruneRequests(maxConcurrentRequests - 1)
+
+    future = _getExecutor().submit(_runRequest, function, *args)
+    pendingRequests.append((future, positions))
+    return future
+
+
+def _runRequest(function, *args):
+    """**Runs a request, counting it as failed if it raises an error.**"""
+    global requestError
     try:
-        response = session.put(url, body)
+        return function(*args)
+    except Exception as e:
+        # Finished requests are pruned without reading their result, so the error is kept until the next join.
+        _markRequestFailed()
+        with journalLock:
+            if requestError is None:
+                requestError = e
+        return None
+
+
+def _fillBlocks(entryId, commands, commandCount, blockCount):
+    """**Sends fill commands to the server.**"""
+    response = _sendCommand(entryId, commands)
+    if response == "connection error":
+        return None
+    with metricsLock:
+        transportMetrics['fillCommands'] += commandCount
+        transportMetrics['fillRequests'] += 1
+        transportMetrics['blocksFilled'] += blockCount
+    return response
+
 
-        # Since the Forge HTTP mod does not support block data in the body, sent the block data as a
-        # data merge command after the corrosponding block has already been placed.
-        # https://minecraft.fandom.com/wiki/Commands/data
-        for bp in blockBuffer:
-            if bool(re.search(r'{.+}$', bp[-1])):
-                runCommand('data merge block {} {} {} {}'.format(bp[0], bp[1], bp[2], bp[-1]))
+def _putBlocks(entryId, path, body, blockCount, blockEntityCommands, retries):
+    """**Sends buffered blocks and their block entity commands to the server.**
 
-        clearBlockBuffer()
-        return response.text
-    except ConnectionError as e:
-        print(f"Request failed: {e} Retrying ({retries} left)")
-        if retries > 0:
-            return sendBlocks(x, y, z, retries - 1)
+    Once a request has failed all its retries, the journaled requests
+    after it are no longer sent so they can be replayed in order by
+    `resumeJournal`.
+    """
+    if failedRequestCount > 0:
+        _markRequestFailed()
+        return None
+    url = f'{host}{path}'
+    while True:
+        requestStart = time.perf_counter()
+        try:
+            response = session.put(url, body)
+            error = None if response.ok else f"{response.status_code} - {response.text}"
+        except ConnectionError as e:
+            error = e
+        batchSize.record(blockCount, len(body), time.perf_counter() - requestStart, failed=error is not None)
+        if error is None:
+            break
+        # HTTP errors count as failed attempts too, so the request is retried and never acknowledged.
+        if retries <= 0:
+            print(f"Request failed: {error} Giving up")
+            _markRequestFailed()
+            return None
+        print(f"Request failed: {error} Retrying ({retries} left)")
+        retries -= 1
+
+    # Since the Forge HTTP mod does not support block data in the body, sent the block data as
+    # data merge commands after the corrosponding blocks have already been placed.
+    # https://minecraft.fandom.com/wiki/Commands/data
+    for i in range(0, len(blockEntityCommands), maxCommandsPerRequest):
+        if _postCommand(str.join("\n", blockEntityCommands[i:i + maxCommandsPerRequest])) == "connection error":
+            _markRequestFailed()
+            return None
+        with metricsLock:
+            transportMetrics['blockEntityCommands'] += len(blockEntityCommands[i:i + maxCommandsPerRequest])
+            transportMetrics['blockEntityRequests'] += 1
+
+    _acknowledgeJournal(entryId)
+    return response.text
 
 
 def _registerSetBlock(x, y, z, material, properties, blockData):
     """**Places a block in the buffer.**"""
-    global blockBuffer
-    block = (x, y, z, material, properties, blockData)
-    blockBuffer.append(block)
+    position = (int(x), int(y), int(z))
+    if position in blockBuffer:
+        with metricsLock:
+            transportMetrics['blocksCoalesced'] += 1
+    blockBuffer[position] = (material, properties, blockData)
+    if blockData != '{}':
+        blockEntityBuffer[position] = 'data merge block {} {} {} {}'.format(*position, blockData)
+    else:
+        blockEntityBuffer.pop(position, None)
 
 
 def clearBlockBuffer():
     """**Clears the block buffer.**"""
-    global blockBuffer
-    blockBuffer = []
+    global blockBuffer, blockEntityBuffer
+    blockBuffer = {}
+    blockEntityBuffer = {}
+
+
+# --------------------------------------------------------- world diff
+
+# World slice holding the world as it was before generation, blocks already in this state are not sent.
+diffWorldSlice = None
+# Positions and (per chunk) regions changed since the world slice was loaded.
+modifiedPositions = set()
+modifiedRegions = {}
+parsedBlockStates = {}
+
+
+def setDiffWorldSlice(worldSlice):
+    """**Skips sending blocks that are identical to the block in worldSlice.**
+
+    worldSlice must describe the world as it is when this is called, pass
+    None to send every block again.
+    """
+    global diffWorldSlice, modifiedPositions, modifiedRegions
+    join()
+    diffWorldSlice = worldSlice
+    modifiedPositions = set()
+    modifiedRegions = {}
+
+
+def _dropUnchangedBlocks(blocks, x, y, z):
+    """**Returns the blocks which differ from the world, remembering where the world changes.**"""
+    changedBlocks = []
+    unchangedCount = 0
+    for bp in blocks:
+        position = (bp[0] + x, bp[1] + y, bp[2] + z)
+        if bp[5] == '{}' and position not in modifiedPositions and not _isInModifiedRegion(position):
+            blockState = diffWorldSlice.getBlockStateAt(*position)
+            if blockState is not None and blockState == _parseBlockState(bp[3], bp[4]):
+                unchangedCount += 1
+                continue
+        modifiedPositions.add(position)
+        changedBlocks.append(bp)
+    with metricsLock:
+        transportMetrics['blocksUnchanged'] += unchangedCount
+    return changedBlocks
+
+
+def _parseBlockState(material, properties):
+    """**Returns a buffered block as (namespaced id, properties) like WorldSlice.getBlockStateAt.**"""
+    blockState = parsedBlockStates.get((material, properties))
+    if blockState is None:
+        name = material if ':' in material else 'minecraft:' + material
+        blockState = (name, dict(
+            entry.split('=', 1) for entry in properties.strip('[]').split(',') if '=' in entry
+        ))
+        parsedBlockStates[(material, properties)] = blockState
+    return blockState
+
+
+def _getCommandBoxes(command):
+    """**Yields the boxes changed by the fill, setblock and clone commands in command.**
+
+    Yields None for commands whose relative coordinates cannot be resolved here.
+    """
+    for line in command.splitlines():
+        parts = line.split()
+        try:
+            if len(parts) >= 8 and parts[0] == 'fill':
+                boxes = [tuple(int(part) for part in parts[1:7])]
+            elif len(parts) >= 5 and parts[0] == 'setblock':
+                boxes = [tuple(int(part) for part in parts[1:4]) * 2]
+            elif len(parts) >= 10 and parts[0] == 'clone':
+                source = tuple(int(part) for part in parts[1:7])
+                destination = tuple(int(part) for part in parts[7:10])
+                boxes = [destination + tuple(destination[i] + abs(source[i + 3] - source[i]) for i in range(3))]
+                # Moving leaves air behind at the source.
+                if 'move' in parts[10:]:
+                    boxes.append(source)
+            else:
+                continue
+        except ValueError:
+            yield None
+            continue
+        for box in boxes:
+            yield (min(box[0], box[3]), min(box[1], box[4]), min(box[2], box[5]),
+                   max(box[0], box[3]), max(box[1], box[4]), max(box[2], box[5]))
+
+
+def _markCommandRegions(command):
+    """**Remembers the regions changed by fill, setblock and clone commands.**
+
+    Stops skipping unchanged blocks until `setDiffWorldSlice` is called again
+    if a command changes positions that cannot be resolved.
+    """
+    global diffWorldSlice
+    for box in _getCommandBoxes(command):
+        if box is None:
+            diffWorldSlice = None
+            return
+        for chunkX in range(box[0] >> 4, (box[3] >> 4) + 1):
+            for chunkZ in range(box[2] >> 4, (box[5] >> 4) + 1):
+                modifiedRegions.setdefault((chunkX, chunkZ), set()).add(box)
+
+
+def _isInModifiedRegion(position):
+    for box in modifiedRegions.get((position[0] >> 4, position[2] >> 4), ()):
+        if box[0] <= position[0] <= box[3] and box[1] <= position[1] <= box[4] and box[2] <= position[2] <= box[5]:
+            return True
+    return False
+
+
+# --------------------------------------------------------- cuboid compression
+
+# Smallest box of identical blocks sent as a fill command instead of single blocks, 0 to disable.
+minimumFillVolume = 8
+# Largest number of blocks Minecraft allows a single fill command to change.
+maximumFillVolume = 32768
+
+
+def _mergeCuboids(blocks):
+    """**Greedily merges buffered blocks into boxes of identical block states.**
+
+    Returns the blocks left over and the boxes as (x1, y1, z1, x2, y2, z2,
+    material, properties, positions). Blocks with block entity data are
+    never merged.
+    """
+    groups = {}
+    remainingBlocks = []
+    for bp in blocks:
+        if bp[5] != '{}':
+            remainingBlocks.append(bp)
+            continue
+        groups.setdefault((bp[3], bp[4]), set()).add(bp[:3])
+
+    cuboids = []
+    for (material, properties), positions in groups.items():
+        remaining = set(positions)
+        # Visiting positions in ascending order makes every position the lowest corner of its box.
+        for position in sorted(positions):
+            if position not in remaining:
+                continue
+            x1, y1, z1 = position
+            x2, y2, z2 = position
+            while (x1, y1, z2 + 1) in remaining and z2 + 2 - z1 <= maximumFillVolume:
+                z2 += 1
+            while (x2 + 2 - x1) * (z2 + 1 - z1) <= maximumFillVolume and \
+                    all((x2 + 1, y1, z) in remaining for z in range(z1, z2 + 1)):
+                x2 += 1
+            while (x2 + 1 - x1) * (y2 + 2 - y1) * (z2 + 1 - z1) <= maximumFillVolume and \
+                    all((x, y2 + 1, z) in remaining for x in range(x1, x2 + 1) for z in range(z1, z2 + 1)):
+                y2 += 1
+
+            box = frozenset(
+                (x, y, z) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1) for z in range(z1, z2 + 1)
+            )
+            remaining -= box
+            if len(box) >= minimumFillVolume:
+                cuboids.append((x1, y1, z1, x2, y2, z2, material, properties, box))
+            else:
+                remainingBlocks.extend(p + (material, properties, '{}') for p in sorted(box))
+    return remainingBlocks, cuboids
+
+
+# --------------------------------------------------------- request pipeline
+
+executor = None
+pendingRequests = []
+# First error raised while sending a block request, raised again by join.
+requestError = None
+
+
+def setMaxConcurrentRequests(limit):
+    """**Sets how many block requests may be in flight at the same time.**"""
+    global maxConcurrentRequests, executor
+    join()
+    maxConcurrentRequests = max(1, limit)
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=maxConcurrentRequests))
+    if executor is not None:
+        executor.shutdown()
+        executor = None
+
+
+def _getExecutor():
+    """**Returns the thread pool sending block requests, creating it if needed.**"""
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=maxConcurrentRequests, thread_name_prefix='sendBlocks')
+    return executor
+
+
+def _pruneRequests(limit):
+    """**Waits until at most `limit` block requests are in flight.**"""
+    global pendingRequests
+    pendingRequests = [request for request in pendingRequests if not request[0].done()]
+    while len(pendingRequests) > limit:
+        pendingRequests.pop(0)[0].result()
+
+
+def join():
+    """**Waits for all block requests in flight to finish.**
+
+    Raises the error of the sender thread or of a block request if either
+    failed.
+    """
+    if senderThread is not None:
+        sendQueue.join()
+    _pruneRequests(0)
+    _raiseSenderError()
+    if requestError is not None:
+        raise requestError
+
+
+def flush():
+    """**Sends the remaining buffer and waits until all blocks have been placed.**
+
+    Raises the error of a block request that failed unexpectedly, and a
+    ConnectionError if any request could not be sent.
+    """
+    sendBlocks()
+    try:
+        join()
+    finally:
+        _discardWrittenChunks()
+    if failedRequestCount > 0:
+        raise ConnectionError(
+            f"{failedRequestCount} requests could not be sent. "
+            f"Replay the requests kept in the journal with main.py --resume."
+        )
+
+
+# --------------------------------------------------------- sender thread
+
+# Maximum number of buffers waiting for the sender thread before the generator has to wait.
+maxQueuedBuffers = 8
+
+sendQueue = None
+senderThread = None
+senderError = None
+
+
+def startSenderThread(maxQueueSize=None):
+    """**Hands buffers to a background thread that turns them into requests.**
+
+    Generation then only waits for the network when maxQueueSize buffers
+    are already queued. Errors of the sender thread are raised by the next
+    `sendBlocks`, `join` or `flush` call.
+    """
+    global sendQueue, senderThread, senderError
+    if senderThread is not None:
+        return
+    join()
+    sendQueue = queue.Queue(maxsize=maxQueuedBuffers if maxQueueSize is None else maxQueueSize)
+    senderError = None
+    senderThread = threading.Thread(target=_runSender, args=(sendQueue,), name='blockSender', daemon=True)
+    senderThread.start()
+
+
+def stopSenderThread():
+    """**Lets the sender thread handle the buffers still queued and stops it.**"""
+    global sendQueue, senderThread
+    if senderThread is None:
+        return
+    sendQueue.put(None)
+    senderThread.join()
+    sendQueue = None
+    senderThread = None
+    _discardWrittenChunks()
+
+
+def _runSender(buffers):
+    """**Turns queued buffers into requests until it receives None.**"""
+    global senderError
+    while True:
+        buffered = buffers.get()
+        try:
+            if buffered is None:
+                return
+            # After an error, keep draining the queue so the generator is never blocked on it.
+            if senderError is None:
+                _emitBlocks(*buffered)
+        except Exception as e:
+            senderError = e
+        finally:
+            buffers.task_done()
+
+
+def _raiseSenderError():
+    if senderError is not None:
+        raise senderError
+
+
+# --------------------------------------------------------- journal
+
+# Append-only log of every request changing the world. Each request is written before it is sent
+# and acknowledged by a later {"ack": id} line once the server has handled it.
+journalFile = None
+journalEntryCount = 0
+journalLock = threading.Lock()
+# Number of requests not sent. After the first request that fails all retries, requests are only journaled.
+failedRequestCount = 0
+# Chunks written to by journaled requests since the chunk cache was last updated, None if a request wrote to positions
+# that could not be resolved.
+writtenChunks = set()
+
+
+def openJournal(path='placement.journal'):
+    """**Starts a new journal of all requests changing the world at path.**"""
+    global journalFile, journalEntryCount
+    closeJournal()
+    journalFile = open(path, 'w', encoding='utf-8')
+    journalEntryCount = 0
+
+
+def closeJournal():
+    """**Closes the journal.**"""
+    global journalFile
+    with journalLock:
+        if journalFile is not None:
+            journalFile.close()
+            journalFile = None
+
+
+def resumeJournal(path='placement.journal'):
+    """**Replays the requests in the journal that were never acknowledged.**
+
+    Requests are replayed in their original order and acknowledged in the
+    same journal, so an interrupted resume can be resumed again. Returns
+    the number of requests replayed.
+    """
+    global journalFile, journalEntryCount, failedRequestCount
+    join()
+    closeJournal()
+    entries = []
+    acknowledged = set()
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may have been cut off when the previous run stopped.
+                continue
+            if 'ack' in entry:
+                acknowledged.add(entry['ack'])
+            else:
+                entries.append(entry)
+
+    journalFile = open(path, 'a', encoding='utf-8')
+    journalEntryCount = max([entry['id'] for entry in entries], default=0)
+    failedRequestCount = 0
+
+    unacknowledged = [entry for entry in entries if entry['id'] not in acknowledged]
+    for entry in unacknowledged:
+        with journalLock:
+            _markWrittenChunks(entry['method'], entry['path'], entry['body'])
+        if entry['method'] == 'PUT':
+            blockCount = entry['body'].count("\n") + 1
+            _putBlocks(entry['id'], entry['path'], entry['body'], blockCount, entry['commands'], 5)
+        else:
+            _sendCommand(entry['id'], entry['body'])
+    return len(unacknowledged)
+
+
+def _writeJournal(method, path, body, commands=()):
+    """**Appends a request to the journal and returns its id.**"""
+    global journalEntryCount
+    with journalLock:
+        _markWrittenChunks(method, path, body)
+        journalEntryCount += 1
+        if journalFile is not None:
+            journalFile.write(json.dumps({
+                'id': journalEntryCount,
+                'method': method,
+                'path': path,
+                'body': body,
+                'commands': list(commands)
+            }) + "\n")
+            journalFile.flush()
+        return journalEntryCount
+
+
+def _acknowledgeJournal(entryId):
+    """**Marks a request in the journal as handled by the server.**"""
+    with journalLock:
+        if journalFile is not None:
+            journalFile.write(json.dumps({'ack': entryId}) + "\n")
+            journalFile.flush()
+
+
+def _markWrittenChunks(method, path, body):
+    """**Remembers the chunks a request writes to, call while holding journalLock.**"""
+    global writtenChunks
+    if writtenChunks is None:
+        return
+    if method == 'PUT':
+        query = dict(parameter.split('=', 1) for parameter in path.split('?', 1)[1].split('&'))
+        for line in body.splitlines():
+            parts = line.split(maxsplit=3)
+            writtenChunks.add(((int(query['x']) + int(parts[0][1:])) >> 4, (int(query['z']) + int(parts[2][1:])) >> 4))
+        return
+    for box in _getCommandBoxes(body):
+        if box is None:
+            writtenChunks = None
+            return
+        writtenChunks.update((chunkX, chunkZ)
+                             for chunkX in range(box[0] >> 4, (box[3] >> 4) + 1)
+                             for chunkZ in range(box[2] >> 4, (box[5] >> 4) + 1))
+
+
+def _discardWrittenChunks():
+    """**Removes the chunks written to from the chunk cache, so the next run loads them from the server again.**"""
+    global writtenChunks
+    # Imported here, as worldLoader imports this module.
+    import worldLoader
+    with journalLock:
+        chunks = writtenChunks
+        writtenChunks = set()
+    if worldLoader.chunkCache is None:
+        return
+    if chunks is None:
+        worldLoader.chunkCache.clear()
+    else:
+        worldLoader.chunkCache.discard(chunks)
+
+
+def _markRequestFailed():
+    """**Counts a request that was not sent, stopping further requests after the first.**"""
+    global failedRequestCount
+    with journalLock:
+        if failedRequestCount == 0:
+            print("Request failed, the remaining requests are only written to the journal")
+        failedRequestCount += 1
+
+
+# --------------------------------------------------------- batch sizing
+
+
+class AdaptiveBatchSize:
+    """**Picks the number of blocks per request from measured throughput.**
+
+    The batch size grows while each step improves the blocks sent per second
+    and settles on the best size once it stops improving. Failed requests and
+    latency spikes halve the batch size and start the search again.
+    """
+
+    def __init__(self, initialSize=50, minimumSize=10, maximumSize=10000, maximumBytes=1 << 20,
+                 growthFactor=1.5, minimumGain=0.05, spikeFactor=3.0):
+        self.size = initialSize
+        self.minimumSize = minimumSize
+        self.maximumSize = maximumSize
+        self.maximumBytes = maximumBytes
+        self.growthFactor = growthFactor
+        self.minimumGain = minimumGain
+        self.spikeFactor = spikeFactor
+
+        self.settled = False
+        self.bestSize = initialSize
+        self.bestThroughput = 0.0
+        self.latencyPerBlock = None
+        self.bytesPerBlock = None
+        self.requestCount = 0
+        self.blockCount = 0
+        self.byteCount = 0
+        self.failureCount = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"AdaptiveBatchSize(size={self.size}, settled={self.settled})"
+
+    def record(self, blockCount, byteCount, latency, failed=False):
+        """**Updates the batch size with the measurements of a single request.**"""
+        with self.lock:
+            self.requestCount += 1
+            if failed:
+                self.failureCount += 1
+                self._shrink()
+                return
+            self.blockCount += blockCount
+            self.byteCount += byteCount
+            if blockCount == 0:
+                return
+            self.bytesPerBlock = byteCount / blockCount if self.bytesPerBlock is None \
+                else 0.8 * self.bytesPerBlock + 0.2 * byteCount / blockCount
+
+            # Partial batches (eg. the end of a structure) say nothing about the current size.
+            if blockCount < self.size:
+                return
+
+            latencyPerBlock = max(latency, 1e-6) / blockCount
+            if self.latencyPerBlock is not None and latencyPerBlock > self.spikeFactor * self.latencyPerBlock:
+                self._shrink()
+                return
+            self.latencyPerBlock = latencyPerBlock if self.latencyPerBlock is None \
+                else 0.8 * self.latencyPerBlock + 0.2 * latencyPerBlock
+
+            if self.settled:
+                return
+            throughput = 1 / latencyPerBlock
+            if throughput > self.bestThroughput * (1 + self.minimumGain):
+                self.bestThroughput = throughput
+                self.bestSize = self.size
+                self.size = self._clamp(int(self.size * self.growthFactor) + 1)
+                if self.size == self.bestSize:
+                    self.settled = True
+            else:
+                self.size = self.bestSize
+                self.settled = True
+
+    def _shrink(self):
+        self.size = self._clamp(self.size // 2)
+        self.bestSize = self.size
+        self.bestThroughput = 0.0
+        self.latencyPerBlock = None
+        self.settled = False
+
+    def _clamp(self, size):
+        if self.bytesPerBlock:
+            size = min(size, int(self.maximumBytes / self.bytesPerBlock))
+        return max(self.minimumSize, min(self.maximumSize, size))
+
+
+batchSize = AdaptiveBatchSize()
+
+
+# --------------------------------------------------------- metrics
+
+# Block entity commands would each have cost a request of their own before they were batched, so
+# blockEntityCommands vs. blockEntityRequests shows the request count before and after batching.
+# blocksCoalesced counts buffered writes replaced by a later write before being sent, blocksUnchanged
+# the writes skipped because the world already has that block and blocksFilled the blocks sent as
+# fill commands rather than one by one.
+transportMetrics = {
+    'blockEntityCommands': 0,
+    'blockEntityRequests': 0,
+    'blocksCoalesced': 0,
+    'blocksUnchanged': 0,
+    'fillCommands': 0,
+    'fillRequests': 0,
+    'blocksFilled': 0
+}
+metricsLock = threading.Lock()
+
+
+def getTransportMetrics():
+    """**Returns statistics on the block requests sent so far.**"""
+    with metricsLock:
+        metrics = dict(transportMetrics)
+    return {
+        'blockRequests': batchSize.requestCount,
+        'failedBlockRequests': batchSize.failureCount,
+        'blocksSent': batchSize.blockCount,
+        'bytesSent': batchSize.byteCount,
+        'batchSize': batchSize.size,
+        'batchSizeSettled': batchSize.settled,
+        **metrics
+    }
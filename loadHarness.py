@@ -0,0 +1,119 @@
+# ! /usr/bin/python3
+"""### Measure generator throughput against the local stand-in server.
+
+Runs `SettlementBuilder` end to end against a `LocalServer` and reports
+blocks per second and requests per second. Run from the repository root:
+
+    python loadHarness.py --size 256 --latency 0.02
+
+With `--world-only` it measures how long loading the build area into a
+`WorldSlice` takes instead.
+"""
+import argparse
+import time
+
+import globals
+import interface
+import worldLoader
+from localServer import LocalServer
+from SettlementBuilder import SettlementBuilder
+from chunkCache import ChunkCache
+from worldLoader import WorldSlice
+
+
+def runLoadTest(size=128, latency=0.0, chunkDirectory=None, seed=None, maxConcurrentRequests=None):
+    """**Generate a settlement against a local server and return throughput statistics.**"""
+    with LocalServer(buildArea=(0, 0, 0, size, 255, size), chunkDirectory=chunkDirectory, latency=latency) as server:
+        interface.setHost(server.url)
+        if maxConcurrentRequests is not None:
+            interface.setMaxConcurrentRequests(maxConcurrentRequests)
+
+        globals.initialize()
+        start = time.perf_counter()
+        interface.startSenderThread()
+        try:
+            SettlementBuilder(seed=seed)
+            interface.flush()
+        finally:
+            interface.stopSenderThread()
+        duration = time.perf_counter() - start
+
+        requestCount = server.getRequestCount()
+        return {
+            'duration': duration,
+            'blocksWritten': server.blocksWritten,
+            'requests': requestCount,
+            'blocksPerSecond': server.blocksWritten / duration,
+            'requestsPerSecond': requestCount / duration,
+            'requestsPerEndpoint': {
+                '{} {}'.format(*endpoint): count for endpoint, count in server.requestCounts.items()
+            },
+            'transport': interface.getTransportMetrics()
+        }
+
+
+def runWorldLoadTest(size=128, latency=0.0, chunkDirectory=None, tileSize=None, chunkCacheDirectory=None):
+    """**Load the build area into a WorldSlice and return loading statistics.**
+
+    The area is loaded once beforehand so the server has generated or read
+    every chunk and the chunk cache, if any, is filled. The statistics only
+    cover the second load.
+    """
+    if tileSize is not None:
+        worldLoader.tileSize = tileSize
+    with LocalServer(buildArea=(0, 0, 0, size, 255, size), chunkDirectory=chunkDirectory, latency=latency) as server:
+        interface.setHost(server.url)
+        if chunkCacheDirectory is not None:
+            worldLoader.chunkCache = ChunkCache(chunkCacheDirectory,
+                                                serverState={'seed': interface.requestWorldSeed()})
+        WorldSlice((0, 0, size, size))
+        requestCount = server.getRequestCount()
+        start = time.perf_counter()
+        WorldSlice((0, 0, size, size))
+        duration = time.perf_counter() - start
+        return {
+            'duration': duration,
+            'requests': server.getRequestCount() - requestCount,
+            'chunksPerSecond': ((size + 15) // 16) ** 2 / duration
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure generator throughput against a local server.')
+    parser.add_argument('--size', type=int, default=128, help='width and depth of the build area')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated latency per request in seconds')
+    parser.add_argument('--chunks', default=None, help='directory with chunk fixture files')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the settlement generator')
+    parser.add_argument('--concurrency', type=int, default=None, help='maximum block requests in flight')
+    parser.add_argument('--world-only', action='store_true', help='only measure loading the build area')
+    parser.add_argument('--tile-size', type=int, default=None, help='width and depth in chunks of fetched tiles')
+    parser.add_argument('--chunk-cache', default=None, help='directory of the decoded chunk cache to load from')
+    args = parser.parse_args()
+
+    if args.world_only:
+        if args.concurrency is not None:
+            interface.setMaxConcurrentRequests(args.concurrency)
+        results = runWorldLoadTest(
+            size=args.size,
+            latency=args.latency,
+            chunkDirectory=args.chunks,
+            tileSize=args.tile_size,
+            chunkCacheDirectory=args.chunk_cache
+        )
+        print('world loaded in {:.2f}s, {} requests, {:.0f} chunks/s'.format(
+            results['duration'], results['requests'], results['chunksPerSecond']))
+        raise SystemExit
+
+    results = runLoadTest(
+        size=args.size,
+        latency=args.latency,
+        chunkDirectory=args.chunks,
+        seed=args.seed,
+        maxConcurrentRequests=args.concurrency
+    )
+    print('generated in {:.2f}s'.format(results['duration']))
+    print('{} blocks written, {:.0f} blocks/s'.format(results['blocksWritten'], results['blocksPerSecond']))
+    print('{} requests, {:.1f} requests/s'.format(results['requests'], results['requestsPerSecond']))
+    for endpoint, count in sorted(results['requestsPerEndpoint'].items()):
+        print('  {}: {}'.format(endpoint, count))
+    print('block transport: {}'.format(results['transport']))
@@ -0,0 +1,335 @@
+# ! /usr/bin/python3
+"""### Provide an offline stand-in for the GDMC HTTP interface.
+
+This module contains:
+* A local HTTP server answering `/buildarea`, `/chunks`, `/blocks` and `/command`
+* Tools to create and capture chunk fixture files served by it
+
+Chunks are served from fixture files named `chunk.<x>.<z>.nbt` (see
+`captureChunkFixtures`). Chunks without a fixture are generated as rolling
+terrain with a sea, so the generator can run without any fixtures at all.
+Block writes and commands are recorded in memory.
+"""
+__all__ = ['LocalServer', 'createChunk', 'captureChunkFixtures']
+__version__ = "v1.0"
+
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from nbt import nbt
+
+import interface
+
+SEALEVEL = 62
+
+
+class LocalServer:
+    """**Serves the GDMC HTTP interface from fixture files and memory**."""
+
+    def __init__(self, buildArea=(0, 0, 0, 128, 255, 128), chunkDirectory=None, latency=0.0,
+                 port=0, groundLevel=64):
+        """**Initialise the server**.
+
+        buildArea is given as (xFrom, yFrom, zFrom, xTo, yTo, zTo), latency
+        in seconds is added to every request and port 0 picks a free port.
+        """
+        self.buildArea = buildArea
+        self.chunkDirectory = Path(chunkDirectory) if chunkDirectory is not None else None
+        self.latency = latency
+        self.groundLevel = groundLevel
+
+        self.blocks = {}
+        self.commands = []
+        self.requestCounts = Counter()
+        self.blocksWritten = 0
+        self.lock = threading.Lock()
+        self.chunkCache = {}
+
+        self.httpServer = ThreadingHTTPServer(('localhost', port), _RequestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.localServer = self
+        self.thread = None
+
+    def __repr__(self):
+        return f"LocalServer({self.url})"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        """**Return the address the server listens on**."""
+        return 'http://localhost:{}'.format(self.httpServer.server_address[1])
+
+    def start(self):
+        """**Start serving requests on a background thread**."""
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, name='LocalServer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """**Stop serving requests**."""
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def getRequestCount(self):
+        """**Return the total number of requests served**."""
+        with self.lock:
+            return sum(self.requestCounts.values())
+
+    # --------------------------------------------------------- endpoints
+
+    def getBuildArea(self):
+        keys = ('xFrom', 'yFrom', 'zFrom', 'xTo', 'yTo', 'zTo')
+        return json.dumps(dict(zip(keys, self.buildArea)))
+
+    def getChunks(self, x, z, dx, dz):
+        chunks = nbt.TAG_List(name='Chunks', type=nbt.TAG_Compound)
+        # Chunks are listed in x, z order, matching the chunk index x + z * dx.
+        for chunkZ in range(z, z + dz):
+            for chunkX in range(x, x + dx):
+                chunks.tags.append(self.getChunk(chunkX, chunkZ))
+        root = nbt.NBTFile()
+        root.name = ''
+        root.tags.append(chunks)
+        root.tags.append(nbt.TAG_Int(name='DataVersion', value=2586))
+        buffer = BytesIO()
+        root.write_file(buffer=buffer)
+        return buffer.getvalue()
+
+    def getChunk(self, x, z):
+        """**Return the chunk at chunk coordinates x, z from its fixture or generate it**."""
+        with self.lock:
+            chunk = self.chunkCache.get((x, z))
+        if chunk is not None:
+            return chunk
+        fixturePath = None
+        if self.chunkDirectory is not None:
+            fixturePath = self.chunkDirectory / 'chunk.{}.{}.nbt'.format(x, z)
+        if fixturePath is not None and fixturePath.is_file():
+            chunk = nbt.NBTFile(fixturePath, 'rb')
+        else:
+            chunk = createChunk(x, z, self.groundLevel)
+        with self.lock:
+            self.chunkCache[(x, z)] = chunk
+        return chunk
+
+    def getBlock(self, x, y, z):
+        with self.lock:
+            block = self.blocks.get((x, y, z), 'minecraft:air')
+        return re.split(r'[\[{]', block, maxsplit=1)[0]
+
+    def putBlocks(self, x, y, z, body):
+        results = []
+        with self.lock:
+            for line in body.splitlines():
+                parts = line.split(None, 3)
+                if len(parts) != 4:
+                    results.append('0')
+                    continue
+                position = tuple(
+                    _parseCoordinate(part, offset) for part, offset in zip(parts[:3], (x, y, z))
+                )
+                self.blocks[position] = parts[3]
+                self.blocksWritten += 1
+                results.append('1')
+        return str.join('\n', results)
+
+    def runCommands(self, body):
+        results = []
+        with self.lock:
+            for command in body.splitlines():
+                self.commands.append(command)
+                results.append(self._applyCommand(command))
+        return str.join('\n', results)
+
+    def _applyCommand(self, command):
+        # Only plain fill commands change the recorded blocks, filtered replacements need the real world.
+        parts = command.split()
+        if parts == ['seed']:
+            # Generated terrain does not depend on a seed, so every world reports the same one.
+            return 'Seed: [0]'
+        if len(parts) < 8 or parts[0] != 'fill':
+            return '1'
+        if len(parts) > 9 or (len(parts) == 9 and parts[8] not in ('replace', 'destroy')):
+            return '1'
+        fromPosition = [int(part) for part in parts[1:4]]
+        toPosition = [int(part) for part in parts[4:7]]
+        volume = 0
+        for x in range(min(fromPosition[0], toPosition[0]), max(fromPosition[0], toPosition[0]) + 1):
+            for y in range(min(fromPosition[1], toPosition[1]), max(fromPosition[1], toPosition[1]) + 1):
+                for z in range(min(fromPosition[2], toPosition[2]), max(fromPosition[2], toPosition[2]) + 1):
+                    self.blocks[(x, y, z)] = parts[7]
+                    volume += 1
+        self.blocksWritten += volume
+        return str(volume)
+
+
+def _parseCoordinate(value, offset):
+    if value.startswith('~'):
+        return offset + int(value[1:] or 0)
+    return int(value)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one packet, otherwise delayed ACKs add ~40ms to every request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        localServer = self.server.localServer
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+
+        with localServer.lock:
+            localServer.requestCounts[(method, url.path)] += 1
+        if localServer.latency > 0:
+            time.sleep(localServer.latency)
+
+        contentType = 'text/plain'
+        if method == 'GET' and url.path == '/buildarea':
+            response = localServer.getBuildArea().encode('utf-8')
+            contentType = 'application/json'
+        elif method == 'GET' and url.path == '/chunks':
+            response = localServer.getChunks(*[int(query[key]) for key in ('x', 'z', 'dx', 'dz')])
+            contentType = 'application/octet-stream'
+        elif method == 'GET' and url.path == '/blocks':
+            response = localServer.getBlock(*[int(query[key]) for key in ('x', 'y', 'z')]).encode('utf-8')
+        elif method == 'PUT' and url.path == '/blocks':
+            offset = [int(query.get(key, 0)) for key in ('x', 'y', 'z')]
+            response = localServer.putBlocks(*offset, body).encode('utf-8')
+        elif method == 'POST' and url.path == '/command':
+            response = localServer.runCommands(body).encode('utf-8')
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+# --------------------------------------------------------- chunk fixtures
+
+
+def _packLongs(values, bitsPerEntry):
+    """**Pack values into the signed longs of a 1.16 bit array**."""
+    entriesPerLong = 64 // bitsPerEntry
+    longs = []
+    for i in range(0, len(values), entriesPerLong):
+        packed = 0
+        for k, value in enumerate(values[i:i + entriesPerLong]):
+            packed |= value << (k * bitsPerEntry)
+        longs.append(packed - (1 << 64) if packed >= 1 << 63 else packed)
+    return longs
+
+
+def _longArray(name, values):
+    tag = nbt.TAG_Long_Array(name=name)
+    tag.value = values
+    return tag
+
+
+def _surfaceHeight(x, z, groundLevel):
+    return groundLevel + int(round(5 * math.sin(x / 23) + 4 * math.cos(z / 17)))
+
+
+def createChunk(chunkX, chunkZ, groundLevel=64):
+    """**Return a generated 1.16 chunk of rolling hills with water below sea level**."""
+    heights = [[_surfaceHeight(chunkX * 16 + x, chunkZ * 16 + z, groundLevel) for x in range(16)]
+               for z in range(16)]
+
+    def blockAt(x, y, z):
+        height = heights[z][x]
+        if y == 0:
+            return 'minecraft:bedrock'
+        if y < height - 4:
+            return 'minecraft:stone'
+        if y < height - 1:
+            return 'minecraft:dirt'
+        if y == height - 1:
+            return 'minecraft:grass_block' if height > SEALEVEL else 'minecraft:sand'
+        if y < SEALEVEL:
+            return 'minecraft:water'
+        return 'minecraft:air'
+
+    level = nbt.TAG_Compound(name='Level')
+    level.tags.append(nbt.TAG_Int(name='xPos', value=chunkX))
+    level.tags.append(nbt.TAG_Int(name='zPos', value=chunkZ))
+
+    surface = [heights[z][x] for z in range(16) for x in range(16)]
+    floor = [heights[z][x] for z in range(16) for x in range(16)]
+    blocking = [max(height, SEALEVEL) for height in surface]
+    heightmaps = nbt.TAG_Compound(name='Heightmaps')
+    for name, values in (('MOTION_BLOCKING', blocking), ('MOTION_BLOCKING_NO_LEAVES', blocking),
+                         ('OCEAN_FLOOR', floor), ('WORLD_SURFACE', blocking)):
+        heightmaps.tags.append(_longArray(name, _packLongs(values, 9)))
+    level.tags.append(heightmaps)
+
+    sections = nbt.TAG_List(name='Sections', type=nbt.TAG_Compound)
+    for sectionY in range((max(max(surface), SEALEVEL) >> 4) + 1):
+        states = [blockAt(x, sectionY * 16 + y, z) for y in range(16) for z in range(16) for x in range(16)]
+        palette = sorted(set(states))
+        section = nbt.TAG_Compound()
+        section.tags.append(nbt.TAG_Byte(name='Y', value=sectionY))
+        paletteTag = nbt.TAG_List(name='Palette', type=nbt.TAG_Compound)
+        for name in palette:
+            entry = nbt.TAG_Compound()
+            entry.tags.append(nbt.TAG_String(name='Name', value=name))
+            paletteTag.tags.append(entry)
+        section.tags.append(paletteTag)
+        bitsPerEntry = max(4, (len(palette) - 1).bit_length())
+        section.tags.append(_longArray('BlockStates', _packLongs([palette.index(s) for s in states], bitsPerEntry)))
+        sections.tags.append(section)
+    level.tags.append(sections)
+
+    biomes = nbt.TAG_Int_Array(name='Biomes')
+    biomes.value = [1 if heights[min(z * 4, 15)][min(x * 4, 15)] > SEALEVEL else 0
+                    for y in range(64) for z in range(4) for x in range(4)]
+    level.tags.append(biomes)
+
+    chunk = nbt.TAG_Compound()
+    chunk.tags.append(level)
+    chunk.tags.append(nbt.TAG_Int(name='DataVersion', value=2586))
+    return chunk
+
+
+def captureChunkFixtures(directory, x, z, dx, dz):
+    """**Save the chunks in the given chunk rectangle from the server as fixture files**."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    chunkFile = nbt.NBTFile(buffer=BytesIO(interface.getChunks(x, z, dx, dz)))
+    for chunkID, chunk in enumerate(chunkFile['Chunks']):
+        fixture = nbt.NBTFile()
+        fixture.name = ''
+        fixture.tags.extend(chunk.tags)
+        fixture.write_file(str(directory / 'chunk.{}.{}.nbt'.format(x + chunkID % dx, z + chunkID // dx)))
@@ -1,10 +1,47 @@
+import argparse
 from SettlementBuilder import SettlementBuilder
 import interface
 import globals
+import worldLoader
+from chunkCache import ChunkCache
 
 
-globals.initialize()
+# Decode worker processes import this module again, so only run the generator when started as a script.
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a settlement in the build area.')
+    parser.add_argument('--resume', action='store_true',
+                        help='only replay the requests of the previous run that were never acknowledged')
+    parser.add_argument('--journal', default='placement.journal', help='path of the request journal')
+    parser.add_argument('--chunk-cache', default=None, metavar='DIRECTORY',
+                        help='keep the decoded world in this directory between runs')
+    parser.add_argument('--refresh-world', action='store_true',
+                        help='discard the cached world and fetch it from the server again')
+    parser.add_argument('--skip-unchanged-blocks', action='store_true',
+                        help='do not send blocks that are already present in the loaded world')
+    args = parser.parse_args()
 
-SettlementBuilder()
+    # Set up before replaying as well, so the chunks the replayed requests write to are discarded from the cache.
+    if args.chunk_cache is not None:
+        worldLoader.chunkCache = ChunkCache(args.chunk_cache, serverState={'seed': interface.requestWorldSeed()})
+        if args.refresh_world:
+            worldLoader.chunkCache.clear()
 
-interface.sendBlocks()
+    if args.resume:
+        print('replaying {} requests from {}'.format(interface.resumeJournal(args.journal), args.journal))
+        interface.flush()
+    else:
+        globals.initialize()
+
+        interface.openJournal(args.journal)
+        # Send blocks from a background thread while the settlement is being generated.
+        interface.startSenderThread()
+        try:
+            SettlementBuilder(skipUnchangedBlocks=args.skip_unchanged_blocks)
+
+            interface.flush()
+        finally:
+            interface.stopSenderThread()
+
+    print('block transport: {}'.format(interface.getTransportMetrics()))
+    if worldLoader.chunkCache is not None:
+        print('chunk cache: {} hits, {} misses'.format(worldLoader.chunkCache.hits, worldLoader.chunkCache.misses))
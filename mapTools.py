@@ -1,8 +1,28 @@
+import weakref
 from functools import lru_cache
 import numpy as np
 import interface
-from worldLoader import WorldSlice
-from materials import TREES, PLANTS, AIR, INVENTORYLOOKUP, INVENTORY, ASCIIPIXELS
+from worldLoader import WorldSlice, WindowedWorldSlice
+from materials import TREES, PLANTS, AIR, LEAVES, LIQUIDS, INVENTORYLOOKUP, INVENTORY, ASCIIPIXELS
+
+# Heightmaps read by calcHeightMap, the other heightmap types are not decoded.
+HEIGHTMAPTYPES = ['MOTION_BLOCKING', 'OCEAN_FLOOR', 'WORLD_SURFACE']
+
+# Named block filters for calcHeightMaps, a heightmap is lowered past every block in its filter.
+BLOCKFILTERS = {
+    # Ground level without vegetation.
+    'trees': TREES + PLANTS + AIR,
+    # Ignores leaves, but stops at logs.
+    'leaves': LEAVES + AIR,
+    # First block that is not a liquid.
+    'liquids': LIQUIDS + AIR,
+}
+
+# Heightmaps calculated by calcHeightMaps for each world slice, keyed by heightmap type and block filter.
+heightMapCache = weakref.WeakKeyDictionary()
+
+# Build areas of more blocks than this are loaded region by region as they are read.
+WINDOWEDAREA = 512 * 512
 
 
 def getBuildArea(area=(0, 0, 128, 128)):
@@ -19,47 +39,61 @@ def getBuildArea(area=(0, 0, 128, 128)):
         area = (x1, z1, x2 - x1, z2 - z1)
 
     print("working in area xz s%s" % (str(area)))
-    return area, WorldSlice(rect=area)
+    if area[2] * area[3] > WINDOWEDAREA:
+        return area, WindowedWorldSlice(rect=area, heightmapTypes=HEIGHTMAPTYPES)
+    return area, WorldSlice(rect=area, heightmapTypes=HEIGHTMAPTYPES)
 
 
 def calcHeightMap(worldSlice):
-    area = worldSlice.rect
+    heightMapNoTrees, heightMapOceanFloor = calcHeightMaps(worldSlice, [
+        ('MOTION_BLOCKING', 'trees'),
+        ('OCEAN_FLOOR', 'trees')
+    ])
+    return heightMapNoTrees, heightMapOceanFloor, np.array(worldSlice.heightmaps['WORLD_SURFACE'])
 
-    blockFilter = TREES + PLANTS + AIR
-
-    heightMapNoTrees = worldSlice.heightmaps['MOTION_BLOCKING'][:]
-    for x in range(area[2]):
-        for z in range(area[3]):
-            while True:
-                y = heightMapNoTrees[x, z]
-                block = worldSlice.getBlockAt(
-                    x=area[0] + x,
-                    y=y - 1,
-                    z=area[1] + z
-                )
-                if block in blockFilter:
-                    heightMapNoTrees[x, z] -= 1
-                else:
-                    break
-    heightMapNoTrees = np.array(np.minimum(worldSlice.heightmaps['MOTION_BLOCKING'], heightMapNoTrees))
-
-    heightMapOceanFloor = worldSlice.heightmaps['OCEAN_FLOOR'][:]
-    for x in range(area[2]):
-        for z in range(area[3]):
-            while True:
-                y = heightMapOceanFloor[x, z]
-                block = worldSlice.getBlockAt(
-                    x=area[0] + x,
-                    y=y - 1,
-                    z=area[1] + z
-                )
-                if block in blockFilter:
-                    heightMapOceanFloor[x, z] -= 1
-                else:
-                    break
-    heightMapOceanFloor = np.array(np.minimum(worldSlice.heightmaps['OCEAN_FLOOR'], heightMapOceanFloor))
 
-    return heightMapNoTrees, heightMapOceanFloor, np.array(worldSlice.heightmaps['WORLD_SURFACE'])
+# Calculates heightmaps given as (heightmap type, block filter) pairs. Each heightmap type of the world slice is
+# lowered past the blocks in its filter, which is either a name in BLOCKFILTERS or a sequence of namespaced ids.
+# Heightmaps that have not been calculated for this world slice before are calculated together in a single pass.
+def calcHeightMaps(worldSlice, heightMapRequests):
+    cachedHeightMaps = heightMapCache.setdefault(worldSlice, {})
+    keys = [
+        (heightmapType, frozenset(BLOCKFILTERS[blockFilter] if isinstance(blockFilter, str) else blockFilter))
+        for heightmapType, blockFilter in heightMapRequests
+    ]
+    missingKeys = [key for key in dict.fromkeys(keys) if key not in cachedHeightMaps]
+    if missingKeys:
+        heightMaps = lowerHeightMaps(
+            worldSlice,
+            [worldSlice.heightmaps[heightmapType] for heightmapType, _ in missingKeys],
+            [blockFilter for _, blockFilter in missingKeys]
+        )
+        cachedHeightMaps.update(zip(missingKeys, heightMaps))
+    return [np.array(cachedHeightMaps[key]) for key in keys]
+
+
+# Returns copies of the heightmaps where every column of the build area is lowered for as long as the block below
+# it is in the block filter of its heightmap, stopping at y = 0. All columns of all heightmaps are walked down
+# together, one block per step.
+def lowerHeightMaps(worldSlice, heightMaps, blockFilters):
+    area = worldSlice.rect
+    heightMaps = np.array(heightMaps)
+    columns = heightMaps[:, :area[2], :area[3]]
+
+    # One row per heightmap, telling for every block state id if it is in the filter of that heightmap.
+    isFiltered = np.array([worldSlice.palette.getMask(blockFilter) for blockFilter in blockFilters])
+    n, x, z = np.nonzero(columns > 0)
+    while len(n) > 0:
+        blockStateIds = worldSlice.getBlockIds(area[0] + x, columns[n, x, z] - 1, area[1] + z)
+        if isFiltered.shape[1] < len(worldSlice.palette):
+            # Loading more of the world can add block states to the palette.
+            isFiltered = np.array([worldSlice.palette.getMask(blockFilter) for blockFilter in blockFilters])
+        isLowered = isFiltered[n, blockStateIds]
+        n, x, z = n[isLowered], x[isLowered], z[isLowered]
+        columns[n, x, z] -= 1
+        isAboveBottom = columns[n, x, z] > 0
+        n, x, z = n[isAboveBottom], x[isAboveBottom], z[isAboveBottom]
+    return list(heightMaps)
 
 
 def getMostFrequentHeight(heightMap):
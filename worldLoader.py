@@ -5,41 +5,139 @@ This module contains functions to:
 * Calculate a heightmap ideal for building
 * Visualise numpy arrays
 """
-__all__ = ['WorldSlice']
+__all__ = ['WorldSlice', 'WindowedWorldSlice', 'BlockVolume', 'BlockStatePalette', 'decodeChunks']
 __version__ = "v5.0"
 
-from io import BytesIO
-from math import ceil, log2
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
 import nbt
 import numpy as np
 
 from bitarray import BitArray
+from chunkReader import readChunks
 import interface
 from materials import BIOMES
 
+# Biome id of the parts of the slice whose biomes are not known.
+UNKNOWNBIOME = 255
 
-class CachedSection:
-    """**Represents a cached chunk section (16x16x16)**."""
+# Width and depth in chunks of the tiles a WorldSlice is fetched in.
+tileSize = 4
 
-    def __init__(self, palette, blockStatesBitArray):
-        self.palette = palette
-        self.blockStatesBitArray = blockStatesBitArray
+# Maximum number of processes that decode tiles, None for one per processor.
+maxDecodeProcesses = None
+# Number of fetched chunks up to which they are decoded in this process, as handing them to worker processes costs more
+# than it saves for small slices, such as a single region of a WindowedWorldSlice.
+maxInProcessDecodeChunks = 64
+# Process pool that decodes tiles, created on first use and shared by every slice. Its workers are spawned rather than
+# forked, as forking while other threads hold locks can deadlock them.
+decodePool = None
+
+# chunkCache.ChunkCache that decoded chunks are read from and written to, None to always fetch chunks.
+chunkCache = None
+
+
+class BlockStatePalette:
+    """**Interns block states so every state has a single integer id**.
+
+    Id 0 is minecraft:void_air, which is used for missing sections.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.properties = []
+        self.ids = {}
+        self.compounds = {}
+        self.nameArray = None
+        self.intern("minecraft:void_air")
 
-    # __repr__ displays the class well enough so __str__ is omitted
     def __repr__(self):
-        return f"CachedSection({repr(self.palette)}, " \
-               f"{repr(self.blockStatesBitArray)})"
+        return f"BlockStatePalette({len(self)} states)"
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name, properties=None):
+        """**Return the id of a block state, adding it if it is new**."""
+        key = (name, tuple(sorted(properties.items())) if properties else ())
+        blockStateId = self.ids.get(key)
+        if blockStateId is None:
+            blockStateId = len(self.names)
+            self.ids[key] = blockStateId
+            self.names.append(name)
+            self.properties.append(dict(properties) if properties else {})
+            self.nameArray = None
+        return blockStateId
+
+    def internCompound(self, compound):
+        """**Return the id of a block state given as a palette compound**."""
+        properties = None
+        if 'Properties' in compound:
+            properties = {key: tag.value for key, tag in compound['Properties'].items()}
+        return self.intern(compound['Name'].value, properties)
+
+    def getCompound(self, blockStateId):
+        """**Return a block state as a palette compound, None for void_air**."""
+        if blockStateId == 0:
+            return None
+        compound = self.compounds.get(blockStateId)
+        if compound is None:
+            compound = nbt.nbt.TAG_Compound()
+            compound.tags.append(nbt.nbt.TAG_String(name='Name', value=self.names[blockStateId]))
+            if self.properties[blockStateId]:
+                properties = nbt.nbt.TAG_Compound(name='Properties')
+                for key, value in self.properties[blockStateId].items():
+                    properties.tags.append(nbt.nbt.TAG_String(name=key, value=value))
+                compound.tags.append(properties)
+            self.compounds[blockStateId] = compound
+        return compound
+
+    def getMask(self, names):
+        """**Return a boolean array over all ids, True where the namespaced id is in names**."""
+        names = set(names)
+        return np.fromiter((name in names for name in self.names), dtype=bool, count=len(self.names))
+
+    def getNames(self, blockStateIds):
+        """**Return the namespaced ids of an array of block state ids**."""
+        if self.nameArray is None or len(self.nameArray) != len(self.names):
+            self.nameArray = np.array(self.names, dtype=object)
+        return self.nameArray[blockStateIds]
 
 
 class WorldSlice:
     """**Contains information on a slice of the world**."""
 
     def __init__(self, rect=None,
-                 heightmapTypes=None):
+                 heightmapTypes=None, palette=None):
         """**Initialise WorldSlice with region and heightmaps**.
 
-        x2 and z2 are exclusive
+        x2 and z2 are exclusive. Only the heightmaps named in heightmapTypes
+        are decoded. Block states are interned in palette, which
+        can be shared between slices.
         """
+        self._initArea(rect, heightmapTypes, palette)
+
+        # Block state ids of every block in the chunks of the slice, in x, y, z order.
+        # Sections are kept packed and only decoded into this volume when they are first read.
+        self._blocks = np.zeros((self.chunkRect[2] * 16, 256, self.chunkRect[3] * 16), dtype=np.uint16)
+        self.packedSections = {}
+        self.sectionIsDecoded = np.zeros((self.chunkRect[2], 16, self.chunkRect[3]), dtype=bool)
+        self.sectionsDecoded = 0
+        self.sectionLock = threading.Lock()
+
+        # Biome ids of the slice per block column and per 4 blocks in height, in x, y // 4, z order.
+        self.biomes = np.full((self.rect[2], 64, self.rect[3]), UNKNOWNBIOME, dtype=np.uint8)
+
+        for tile, chunks in _loadChunks(self.chunkRect, self.heightmapTypes):
+            self._addTile(tile, chunks)
+
+    def _initArea(self, rect, heightmapTypes, palette):
+        """**Set up the rect, chunkRect, palette and empty heightmaps of the slice**."""
         if heightmapTypes is None:
             heightmapTypes = ["MOTION_BLOCKING",
                               "MOTION_BLOCKING_NO_LEAVES",
@@ -52,13 +150,7 @@ class WorldSlice:
                           ((self.rect[1] + self.rect[3] - 1) >> 4)
                           - (self.rect[1] >> 4) + 1)
         self.heightmapTypes = heightmapTypes
-
-        chunkBytes = interface.getChunks(*self.chunkRect)
-        fileLike = BytesIO(chunkBytes)
-
-        self.nbtfile = nbt.nbt.NBTFile(buffer=fileLike)
-
-        rectOffset = [self.rect[0] % 16, self.rect[1] % 16]
+        self.palette = BlockStatePalette() if palette is None else palette
 
         # heightmaps
         self.heightmaps = {}
@@ -66,52 +158,26 @@ class WorldSlice:
             self.heightmaps[hmName] = np.zeros(
                 (self.rect[2] + 1, self.rect[3] + 1), dtype=int)
 
-        # Sections are in x,z,y order!!! (reverse minecraft order :p)
-        self.sections = [[[None for i in range(16)] for z in range(
-            self.chunkRect[3])] for x in range(self.chunkRect[2])]
-
-        # heightmaps
-        for x in range(self.chunkRect[2]):
-            for z in range(self.chunkRect[3]):
-                chunkID = x + z * self.chunkRect[2]
-
-                hms = self.nbtfile['Chunks'][chunkID]['Level']['Heightmaps']
-                for hmName in self.heightmapTypes:
-                    # hmRaw = hms['MOTION_BLOCKING']
-                    hmRaw = hms[hmName]
-                    heightmapBitArray = BitArray(9, 16 * 16, hmRaw)
-                    heightmap = self.heightmaps[hmName]
-                    for cz in range(16):
-                        for cx in range(16):
-                            try:
-                                heightmap[-rectOffset[0] + x * 16 + cx,
-                                          -rectOffset[1] + z * 16 + cz] \
-                                    = heightmapBitArray.getAt(cz * 16 + cx)
-                            except IndexError:
-                                pass
-
-        # sections
-        for x in range(self.chunkRect[2]):
-            for z in range(self.chunkRect[3]):
-                chunkID = x + z * self.chunkRect[2]
-                chunk = self.nbtfile['Chunks'][chunkID]
-                chunkSections = chunk['Level']['Sections']
-
-                for section in chunkSections:
-                    y = section['Y'].value
-
-                    if (not ('BlockStates' in section)
-                            or len(section['BlockStates']) == 0):
-                        continue
-
-                    palette = section['Palette']
-                    rawBlockStates = section['BlockStates']
-                    bitsPerEntry = max(4, ceil(log2(len(palette))))
-                    blockStatesBitArray = BitArray(bitsPerEntry, 16 * 16 * 16,
-                                                   rawBlockStates)
-
-                    # noinspection PyTypeChecker
-                    self.sections[x][z][y] = CachedSection(palette, blockStatesBitArray)
+    def _addTile(self, tile, chunks):
+        """**Copy the decoded chunks of a tile into the slice**."""
+        for tileChunkID, (heightmaps, sections, biomes) in enumerate(chunks):
+            x = tile[0] - self.chunkRect[0] + tileChunkID % tile[2]
+            z = tile[1] - self.chunkRect[1] + tileChunkID // tile[2]
+
+            # heightmaps, clipped to the part of the chunk that overlaps them
+            for hmName in self.heightmapTypes:
+                _pasteColumns(self.heightmaps[hmName], heightmaps[hmName],
+                              x * 16 - self.rect[0] % 16, z * 16 - self.rect[1] % 16)
+            if len(biomes) == 4 * 64 * 4:
+                self._addBiomes(x, z, biomes)
+
+            # sections, mapping the section palette onto the global palette
+            for y, sectionPalette, bitsPerEntry, blockStates in sections:
+                if not 0 <= y < 16:
+                    continue
+                paletteIds = np.array([self.palette.intern(name, properties)
+                                       for name, properties in sectionPalette], dtype=np.uint16)
+                self.packedSections[(x, y, z)] = (paletteIds, bitsPerEntry, blockStates)
 
     # __repr__ displays the class well enough so __str__ is omitted
     def __repr__(self):
@@ -120,62 +186,529 @@ class WorldSlice:
         x2, z2 = self.rect[0] + self.rect[2], self.rect[1] + self.rect[3]
         return f"WorldSlice{(x1, z1, x2, z2)}"
 
+    def _addBiomes(self, x, z, biomes):
+        """**Copy the biomes of the chunk at x, z relative to chunkRect into the slice**."""
+        # Biomes are stored per 4x4x4 blocks in y, z, x order.
+        chunkBiomes = biomes.reshape((64, 4, 4)).transpose((2, 0, 1)).repeat(4, axis=0).repeat(4, axis=2)
+        _pasteColumns(self.biomes, chunkBiomes, x * 16 - self.rect[0] % 16, z * 16 - self.rect[1] % 16)
+
+    def getMemoryUsage(self):
+        """**Return an estimate of the bytes held by the blocks, heightmaps and biomes of the slice**."""
+        return (self.sectionsDecoded * 16 * 16 * 16 * self._blocks.itemsize
+                + sum(paletteIds.nbytes + blockStates.nbytes
+                      for paletteIds, _, blockStates in list(self.packedSections.values()))
+                + sum(heightmap.nbytes for heightmap in self.heightmaps.values())
+                + self.biomes.nbytes)
+
+    @property
+    def blocks(self):
+        """**Return the block state ids of the whole slice, decoding every section**."""
+        for x, y, z in list(self.packedSections):
+            self._decodeSection(x, y, z)
+        return self._blocks
+
+    def _decodeSection(self, x, y, z):
+        """**Unpack a section into the block volume if it has not been yet**."""
+        if self.sectionIsDecoded[x, y, z]:
+            return
+        with self.sectionLock:
+            if self.sectionIsDecoded[x, y, z]:
+                return
+            packedSection = self.packedSections.pop((x, y, z), None)
+            if packedSection is not None:
+                paletteIds, bitsPerEntry, blockStates = packedSection
+                # Sections are stored in y, z, x order.
+                sectionBlocks = paletteIds[BitArray(bitsPerEntry, 16 * 16 * 16, blockStates).toNumpy()]
+                self._blocks[x * 16:x * 16 + 16, y * 16:y * 16 + 16, z * 16:z * 16 + 16] = \
+                    sectionBlocks.reshape((16, 16, 16)).transpose((2, 0, 1))
+                self.sectionsDecoded += 1
+            self.sectionIsDecoded[x, y, z] = True
+
+    def getBlockIdAt(self, x, y, z):
+        """**Return the block state id at blockPos, 0 outside of the slice**."""
+        x -= self.chunkRect[0] * 16
+        z -= self.chunkRect[1] * 16
+        if not (0 <= x < self._blocks.shape[0] and 0 <= y < 256 and 0 <= z < self._blocks.shape[2]):
+            return 0
+        self._decodeSection(x >> 4, y >> 4, z >> 4)
+        return self._blocks[x, y, z]
+
+    def getBlockIds(self, xs, ys, zs):
+        """**Return the block state ids at arrays of coordinates**.
+
+        Coordinates outside of the slice return 0 (minecraft:void_air).
+        """
+        xs = np.asarray(xs) - self.chunkRect[0] * 16
+        ys = np.asarray(ys)
+        zs = np.asarray(zs) - self.chunkRect[1] * 16
+        inside = (xs >= 0) & (xs < self._blocks.shape[0]) & (ys >= 0) & (ys < 256) \
+            & (zs >= 0) & (zs < self._blocks.shape[2])
+        xs, ys, zs = np.where(inside, xs, 0), np.where(inside, ys, 0), np.where(inside, zs, 0)
+        pending = inside & ~self.sectionIsDecoded[xs >> 4, ys >> 4, zs >> 4]
+        if pending.any():
+            for x, y, z in set(zip((xs[pending] >> 4).tolist(), (ys[pending] >> 4).tolist(),
+                                   (zs[pending] >> 4).tolist())):
+                self._decodeSection(x, y, z)
+        return np.where(inside, self._blocks[xs, ys, zs], 0).astype(np.uint16)
+
+    def getBlocks(self, xs, ys, zs):
+        """**Return the namespaced ids of the blocks at arrays of coordinates**."""
+        return self.palette.getNames(self.getBlockIds(xs, ys, zs))
+
     def getBlockCompoundAt(self, x, y, z):
         """**Return block data**."""
-        chunkX = (x >> 4) - self.chunkRect[0]
-        chunkZ = (z >> 4) - self.chunkRect[1]
-        chunkY = y >> 4
-
-        cachedSection = self.sections[chunkX][chunkZ][chunkY]
-
-        if cachedSection is None:
-            return None  # TODO return air compound instead
+        return self.palette.getCompound(self.getBlockIdAt(x, y, z))
 
-        bitarray = cachedSection.blockStatesBitArray
-        palette = cachedSection.palette
+    def getBlockStateAt(self, x, y, z):
+        """**Return the block's namespaced id and properties at blockPos**.
 
-        blockIndex = (y % 16) * 16 * 16 + \
-                     (z % 16) * 16 + x % 16
-        return palette[bitarray.getAt(blockIndex)]
+        Returns None outside of the slice.
+        """
+        if not (self.rect[0] <= x < self.rect[0] + self.rect[2]
+                and self.rect[1] <= z < self.rect[1] + self.rect[3]
+                and 0 <= y < 256):
+            return None
+        blockStateId = self.getBlockIdAt(x, y, z)
+        return self.palette.names[blockStateId], self.palette.properties[blockStateId]
 
     def getBlockAt(self, x, y, z):
         """**Return the block's namespaced id at blockPos**."""
-        blockCompound = self.getBlockCompoundAt(x, y, z)
-        if blockCompound is None:
-            return "minecraft:void_air"
-        else:
-            return blockCompound["Name"].value
+        return self.palette.names[self.getBlockIdAt(x, y, z)]
+
+    def exportVolume(self, path):
+        """**Write the block state ids of the slice to a .npy file with a .json palette sidecar**.
+
+        Returns the written volume as a BlockVolume.
+        """
+        volume = _createVolume(path, self.rect)
+        _copyVolume(volume, self.rect, self.blocks, self.chunkRect[0] * 16, self.chunkRect[1] * 16)
+        return _finishVolume(path, volume, self.rect, self.palette)
 
     def getBiomeAt(self, x, y, z):
         """**Return biome at given coordinates**.
 
-        Due to the noise around chunk borders,
-            there is an inacurracy of +/-2 blocks.
+        Returns an empty string outside of the slice. Due to the noise around
+        chunk borders, there is an inacurracy of +/-2 blocks.
         """
         x = x - self.rect[0]
         z = z - self.rect[1]
-        chunkID = x // 16 + z // 16 * self.chunkRect[2]
-        try:
-            data = self.nbtfile['Chunks'][chunkID]['Level']['Biomes']
-            x = (x % 16) // 4
-            z = (z % 16) // 4
-            y = y // 4
-            index = x + 4 * z + 16 * y
-            return BIOMES[data[index]]
-        except:
+        if not (0 <= x < self.rect[2] and 0 <= y < 256 and 0 <= z < self.rect[3]):
+            return ''
+        return BIOMES.get(int(self.biomes[x, y >> 2, z]), '')
+
+    def getBiomeIds(self, xs, ys, zs):
+        """**Return the biome ids at arrays of coordinates**.
+
+        Coordinates outside of the slice return UNKNOWNBIOME.
+        """
+        xs = np.asarray(xs) - self.rect[0]
+        ys = np.asarray(ys)
+        zs = np.asarray(zs) - self.rect[1]
+        inside = (xs >= 0) & (xs < self.rect[2]) & (ys >= 0) & (ys < 256) & (zs >= 0) & (zs < self.rect[3])
+        return np.where(inside, self.biomes[
+            np.where(inside, xs, 0), np.where(inside, ys, 0) >> 2, np.where(inside, zs, 0)
+        ], UNKNOWNBIOME).astype(np.uint8)
+
+    def getBiomeHistogram(self, x1, z1, x2, z2, y=None):
+        """**Return the number of biome cells per biome id within a region**.
+
+        x2 and z2 are exclusive and the region is clipped to the slice. Every
+        column counts once per 4 blocks of height, or only at height y if it is
+        given. Ids that are not known count towards UNKNOWNBIOME.
+        """
+        x1, x2 = max(x1 - self.rect[0], 0), max(x2 - self.rect[0], 0)
+        z1, z2 = max(z1 - self.rect[1], 0), max(z2 - self.rect[1], 0)
+        region = self.biomes[x1:x2, :, z1:z2] if y is None else self.biomes[x1:x2, y >> 2, z1:z2]
+        return np.bincount(region.ravel(), minlength=256)
+
+    def getDominantBiome(self, x1, z1, x2, z2, y=None):
+        """**Return the most common biome within a region, an empty string if it is unknown**."""
+        histogram = self.getBiomeHistogram(x1, z1, x2, z2, y)
+        histogram[UNKNOWNBIOME] = 0
+        if not histogram.any():
             return ''
+        return BIOMES.get(int(histogram.argmax()), '')
 
     def getBiomesNear(self, x, y, z):
         """**Return a list of biomes in the same chunk**."""
-        chunkID = x // 16 + z // 16 * self.chunkRect[2]
-        data = self.nbtfile['Chunks'][chunkID]['Level']['Biomes']
-        # "sorted(list(set(data)))" is used to remove duplicates from data
-        return [BIOMES[i] for i in sorted(list(set(data)))]
+        x1, z1 = x >> 4 << 4, z >> 4 << 4
+        histogram = self.getBiomeHistogram(x1, z1, x1 + 16, z1 + 16)
+        return [BIOMES[i] for i in np.flatnonzero(histogram).tolist() if i in BIOMES]
 
     def getPrimaryBiomeNear(self, x, y, z):
         """**Return the most prevelant biome in the same chunk**."""
-        chunkID = x // 16 + z // 16 * self.chunkRect[2]
-        data = self.nbtfile['Chunks'][chunkID]['Level']['Biomes']
-        # "max(set(data), key=data.count)" is used to find the most common item
-        data = max(set(data), key=data.count)
-        return [BIOMES[i] for i in sorted(list(set(data)))]
+        x1, z1 = x >> 4 << 4, z >> 4 << 4
+        return self.getDominantBiome(x1, z1, x1 + 16, z1 + 16)
+
+
+class WindowedWorldSlice(WorldSlice):
+    """**Contains information on a slice of the world that is loaded region by region**.
+
+    Heightmaps and biomes cover the whole slice. Blocks are loaded in regions
+    of regionSize by regionSize chunks when they are first read, and the
+    least recently used regions are dropped once the regions take up more
+    than maximumBytes.
+    """
+
+    def __init__(self, rect=None,
+                 heightmapTypes=None, palette=None, regionSize=8, maximumBytes=512 * 1024 * 1024):
+        """**Initialise WindowedWorldSlice with region and heightmaps**.
+
+        x2 and z2 are exclusive. The heightmaps and biomes are read by
+        streaming every chunk once, without keeping their sections.
+        """
+        self._initArea(rect, heightmapTypes, palette)
+
+        # Biome ids per 4x4 block columns of the chunks and per 4 blocks in height, in x, y, z order.
+        self.biomes = np.full((self.chunkRect[2] * 4, 64, self.chunkRect[3] * 4), UNKNOWNBIOME, dtype=np.uint8)
+
+        self.regionSize = regionSize
+        self.regionCount = (-(-self.chunkRect[2] // regionSize), -(-self.chunkRect[3] // regionSize))
+        self.maximumBytes = maximumBytes
+        self.regions = OrderedDict()
+        self.regionsLoaded = 0
+        # Sections decoded by the regions that have already been dropped.
+        self.droppedSectionsDecoded = 0
+        self.regionLock = threading.RLock()
+
+        for tile, chunks in _loadChunks(self.chunkRect, self.heightmapTypes, readSections=False):
+            # Chunks from the chunk cache still have their sections.
+            self._addTile(tile, [(heightmaps, [], biomes) for heightmaps, _, biomes in chunks])
+
+    def __repr__(self):
+        """**Represent the WindowedWorldSlice as a constructor**."""
+        x1, z1 = self.rect[:2]
+        x2, z2 = self.rect[0] + self.rect[2], self.rect[1] + self.rect[3]
+        return f"WindowedWorldSlice{(x1, z1, x2, z2)}"
+
+    def _addBiomes(self, x, z, biomes):
+        """**Copy the biomes of the chunk at x, z relative to chunkRect into the slice**."""
+        self.biomes[x * 4:x * 4 + 4, :, z * 4:z * 4 + 4] = biomes.reshape((64, 4, 4)).transpose((2, 0, 1))
+
+    def getMemoryUsage(self):
+        """**Return an estimate of the bytes held by the loaded regions, heightmaps and biomes**."""
+        with self.regionLock:
+            regions = list(self.regions.values())
+        return (sum(region.getMemoryUsage() for region in regions)
+                + sum(heightmap.nbytes for heightmap in self.heightmaps.values())
+                + self.biomes.nbytes)
+
+    @property
+    def sectionsDecoded(self):
+        """**Return the number of sections decoded, including those of regions that have been dropped**."""
+        with self.regionLock:
+            return self.droppedSectionsDecoded + sum(region.sectionsDecoded for region in self.regions.values())
+
+    @property
+    def blocks(self):
+        """**A WindowedWorldSlice has no volume of all its blocks, reading it raises an AttributeError**."""
+        raise AttributeError("A WindowedWorldSlice does not hold all its blocks, use getBlockIds instead")
+
+    def exportVolume(self, path):
+        """**Write the block state ids of the slice to a .npy file with a .json palette sidecar**.
+
+        Regions are loaded one at a time, so the slice never holds more than
+        its memory budget. Returns the written volume as a BlockVolume.
+        """
+        volume = _createVolume(path, self.rect)
+        for regionX in range(self.regionCount[0]):
+            for regionZ in range(self.regionCount[1]):
+                region = self._getRegion(regionX, regionZ)
+                _copyVolume(volume, self.rect, region.blocks, region.rect[0], region.rect[1])
+        return _finishVolume(path, volume, self.rect, self.palette)
+
+    def _getRegion(self, regionX, regionZ):
+        """**Return the region at region coordinates relative to chunkRect, loading it if needed**."""
+        with self.regionLock:
+            region = self.regions.get((regionX, regionZ))
+            if region is not None:
+                self.regions.move_to_end((regionX, regionZ))
+                return region
+
+            chunkX = self.chunkRect[0] + regionX * self.regionSize
+            chunkZ = self.chunkRect[1] + regionZ * self.regionSize
+            region = WorldSlice((chunkX * 16, chunkZ * 16,
+                                 min(self.regionSize, self.chunkRect[0] + self.chunkRect[2] - chunkX) * 16,
+                                 min(self.regionSize, self.chunkRect[1] + self.chunkRect[3] - chunkZ) * 16),
+                                heightmapTypes=[], palette=self.palette)
+            self.regions[(regionX, regionZ)] = region
+            self.regionsLoaded += 1
+
+            # Drop the least recently used regions, but never the one that was just loaded.
+            while (len(self.regions) > 1
+                   and sum(loadedRegion.getMemoryUsage() for loadedRegion in self.regions.values())
+                   > self.maximumBytes):
+                self.droppedSectionsDecoded += self.regions.popitem(last=False)[1].sectionsDecoded
+            return region
+
+    def getBlockIdAt(self, x, y, z):
+        """**Return the block state id at blockPos, 0 outside of the slice**."""
+        regionX = ((x >> 4) - self.chunkRect[0]) // self.regionSize
+        regionZ = ((z >> 4) - self.chunkRect[1]) // self.regionSize
+        if not (0 <= regionX < self.regionCount[0] and 0 <= regionZ < self.regionCount[1]):
+            return 0
+        return self._getRegion(regionX, regionZ).getBlockIdAt(x, y, z)
+
+    def getBlockIds(self, xs, ys, zs):
+        """**Return the block state ids at arrays of coordinates**.
+
+        Coordinates outside of the slice return 0 (minecraft:void_air).
+        """
+        xs, ys, zs = np.broadcast_arrays(np.asarray(xs), np.asarray(ys), np.asarray(zs))
+        regionXs = ((xs >> 4) - self.chunkRect[0]) // self.regionSize
+        regionZs = ((zs >> 4) - self.chunkRect[1]) // self.regionSize
+        inside = (regionXs >= 0) & (regionXs < self.regionCount[0]) \
+            & (regionZs >= 0) & (regionZs < self.regionCount[1])
+        blockStateIds = np.zeros(xs.shape, dtype=np.uint16)
+        regionIds = np.where(inside, regionXs * self.regionCount[1] + regionZs, -1)
+        for regionId in np.unique(regionIds[inside]).tolist():
+            inRegion = regionIds == regionId
+            blockStateIds[inRegion] = self._getRegion(*divmod(regionId, self.regionCount[1])).getBlockIds(
+                xs[inRegion], ys[inRegion], zs[inRegion])
+        return blockStateIds
+
+    def getBiomeAt(self, x, y, z):
+        """**Return biome at given coordinates**.
+
+        Returns an empty string outside of the slice. Due to the noise around
+        chunk borders, there is an inacurracy of +/-2 blocks.
+        """
+        if not (self.rect[0] <= x < self.rect[0] + self.rect[2]
+                and self.rect[1] <= z < self.rect[1] + self.rect[3]
+                and 0 <= y < 256):
+            return ''
+        return BIOMES.get(int(self.biomes[(x - self.chunkRect[0] * 16) >> 2, y >> 2,
+                                          (z - self.chunkRect[1] * 16) >> 2]), '')
+
+    def getBiomeIds(self, xs, ys, zs):
+        """**Return the biome ids at arrays of coordinates**.
+
+        Coordinates outside of the slice return UNKNOWNBIOME.
+        """
+        xs, ys, zs = np.asarray(xs), np.asarray(ys), np.asarray(zs)
+        inside = (xs >= self.rect[0]) & (xs < self.rect[0] + self.rect[2]) & (ys >= 0) & (ys < 256) \
+            & (zs >= self.rect[1]) & (zs < self.rect[1] + self.rect[3])
+        return np.where(inside, self.biomes[
+            (np.where(inside, xs, self.rect[0]) - self.chunkRect[0] * 16) >> 2,
+            np.where(inside, ys, 0) >> 2,
+            (np.where(inside, zs, self.rect[1]) - self.chunkRect[1] * 16) >> 2
+        ], UNKNOWNBIOME).astype(np.uint8)
+
+    def getBiomeHistogram(self, x1, z1, x2, z2, y=None):
+        """**Return the number of biome cells per biome id within a region**.
+
+        Counts the same way as WorldSlice.getBiomeHistogram, weighing every
+        4x4 column of biome data by the number of its columns in the region.
+        """
+        x1, x2 = [min(max(x, self.rect[0]), self.rect[0] + self.rect[2]) - self.chunkRect[0] * 16 for x in (x1, x2)]
+        z1, z2 = [min(max(z, self.rect[1]), self.rect[1] + self.rect[3]) - self.chunkRect[1] * 16 for z in (z1, z2)]
+        if x2 <= x1 or z2 <= z1:
+            return np.zeros(256, dtype=int)
+        cellXs = np.arange(x1 >> 2, ((x2 - 1) >> 2) + 1) * 4
+        cellZs = np.arange(z1 >> 2, ((z2 - 1) >> 2) + 1) * 4
+        weightsX = np.minimum(cellXs + 4, x2) - np.maximum(cellXs, x1)
+        weightsZ = np.minimum(cellZs + 4, z2) - np.maximum(cellZs, z1)
+        cells = self.biomes[x1 >> 2:(x2 - 1 >> 2) + 1, :, z1 >> 2:(z2 - 1 >> 2) + 1]
+        if y is not None:
+            cells = cells[:, y >> 2:(y >> 2) + 1, :]
+        weights = np.broadcast_to(weightsX[:, np.newaxis, np.newaxis] * weightsZ[np.newaxis, np.newaxis, :],
+                                  cells.shape)
+        return np.bincount(cells.ravel(), weights=weights.ravel(), minlength=256).astype(int)
+
+
+class BlockVolume:
+    """**Contains the block state ids of a slice exported with WorldSlice.exportVolume**.
+
+    The ids are memory mapped from the .npy file, so the volume can be read
+    without the server and shared between processes. volume is indexed in
+    x, y, z order relative to the corner of rect.
+    """
+
+    def __init__(self, path, mode='r'):
+        """**Open the volume at path, mode is passed on to numpy.load as mmap_mode**."""
+        self.path = Path(path)
+        with open(self.path.with_suffix('.json')) as metadataFile:
+            metadata = json.load(metadataFile)
+        self.rect = tuple(metadata['rect'])
+        self.palette = BlockStatePalette()
+        for blockStateId, (name, properties) in enumerate(metadata['palette']):
+            if self.palette.intern(name, properties) != blockStateId:
+                raise ValueError(f"Duplicate block state {name} in the palette of {self.path}")
+        self.volume = np.load(self.path.with_suffix('.npy'), mmap_mode=mode)
+
+    def __repr__(self):
+        """**Represent the BlockVolume as a constructor**."""
+        return f"BlockVolume({str(self.path)!r})"
+
+    def getBlockIdAt(self, x, y, z):
+        """**Return the block state id at blockPos, 0 outside of the volume**."""
+        x -= self.rect[0]
+        z -= self.rect[1]
+        if not (0 <= x < self.rect[2] and 0 <= y < 256 and 0 <= z < self.rect[3]):
+            return 0
+        return self.volume[x, y, z]
+
+    def getBlockIds(self, xs, ys, zs):
+        """**Return the block state ids at arrays of coordinates**.
+
+        Coordinates outside of the volume return 0 (minecraft:void_air).
+        """
+        xs = np.asarray(xs) - self.rect[0]
+        ys = np.asarray(ys)
+        zs = np.asarray(zs) - self.rect[1]
+        inside = (xs >= 0) & (xs < self.rect[2]) & (ys >= 0) & (ys < 256) & (zs >= 0) & (zs < self.rect[3])
+        return np.where(inside, self.volume[
+            np.where(inside, xs, 0), np.where(inside, ys, 0), np.where(inside, zs, 0)
+        ], 0).astype(np.uint16)
+
+    def getBlocks(self, xs, ys, zs):
+        """**Return the namespaced ids of the blocks at arrays of coordinates**."""
+        return self.palette.getNames(self.getBlockIds(xs, ys, zs))
+
+    def getBlockCompoundAt(self, x, y, z):
+        """**Return block data**."""
+        return self.palette.getCompound(self.getBlockIdAt(x, y, z))
+
+    def getBlockStateAt(self, x, y, z):
+        """**Return the block's namespaced id and properties at blockPos**.
+
+        Returns None outside of the volume.
+        """
+        if not (self.rect[0] <= x < self.rect[0] + self.rect[2]
+                and self.rect[1] <= z < self.rect[1] + self.rect[3]
+                and 0 <= y < 256):
+            return None
+        blockStateId = self.getBlockIdAt(x, y, z)
+        return self.palette.names[blockStateId], self.palette.properties[blockStateId]
+
+    def getBlockAt(self, x, y, z):
+        """**Return the block's namespaced id at blockPos**."""
+        return self.palette.names[self.getBlockIdAt(x, y, z)]
+
+
+def _createVolume(path, rect):
+    return np.lib.format.open_memmap(Path(path).with_suffix('.npy'), mode='w+', dtype=np.uint16,
+                                     shape=(rect[2], 256, rect[3]))
+
+
+def _copyVolume(volume, rect, blocks, blocksX, blocksZ):
+    """**Copy the part of blocks, which starts at blocksX, blocksZ, that overlaps rect into volume**."""
+    x1, x2 = max(rect[0], blocksX), min(rect[0] + rect[2], blocksX + blocks.shape[0])
+    z1, z2 = max(rect[1], blocksZ), min(rect[1] + rect[3], blocksZ + blocks.shape[2])
+    if x1 < x2 and z1 < z2:
+        volume[x1 - rect[0]:x2 - rect[0], :, z1 - rect[1]:z2 - rect[1]] = \
+            blocks[x1 - blocksX:x2 - blocksX, :, z1 - blocksZ:z2 - blocksZ]
+
+
+def _finishVolume(path, volume, rect, palette):
+    volume.flush()
+    del volume
+    with open(Path(path).with_suffix('.json'), 'w') as metadataFile:
+        json.dump({'rect': list(rect),
+                   'palette': [[name, properties] for name, properties in zip(palette.names, palette.properties)]},
+                  metadataFile)
+    return BlockVolume(path)
+
+
+def _pasteColumns(target, values, x1, z1):
+    """**Copy values into target at x1, z1 along its first and last axis, clipped to target**."""
+    x2 = min(x1 + values.shape[0], target.shape[0])
+    z2 = min(z1 + values.shape[-1], target.shape[-1])
+    if x2 > 0 and z2 > 0:
+        target[max(x1, 0):x2, ..., max(z1, 0):z2] = values[max(-x1, 0):x2 - x1, ..., max(-z1, 0):z2 - z1]
+
+
+def _loadChunks(chunkRect, heightmapTypes, readSections=True):
+    """**Yield every tile of chunkRect together with its decoded chunks**.
+
+    Tiles are fetched concurrently over the pooled connections of the
+    interface, a few at a time, and decoded in the shared process pool when
+    there are more than maxInProcessDecodeChunks chunks and more than one
+    processor. Tiles of which every chunk is in the chunk cache are not
+    fetched at all. Fetched chunks are only added to the cache when their
+    sections are read.
+    """
+    tiles = []
+    for z in range(chunkRect[1], chunkRect[1] + chunkRect[3], tileSize):
+        for x in range(chunkRect[0], chunkRect[0] + chunkRect[2], tileSize):
+            tiles.append((x, z,
+                          min(tileSize, chunkRect[0] + chunkRect[2] - x),
+                          min(tileSize, chunkRect[1] + chunkRect[3] - z)))
+
+    if chunkCache is not None:
+        missingTiles = []
+        for tile in tiles:
+            chunks = []
+            for tileChunkID in range(tile[2] * tile[3]):
+                chunk = chunkCache.load(tile[0] + tileChunkID % tile[2], tile[1] + tileChunkID // tile[2],
+                                        heightmapTypes)
+                if chunk is None:
+                    missingTiles.append(tile)
+                    break
+                chunks.append(chunk)
+            else:
+                yield tile, chunks
+        tiles = missingTiles
+        if not tiles:
+            return
+
+    decoder = None
+    if sum(tile[2] * tile[3] for tile in tiles) > maxInProcessDecodeChunks:
+        decoder = _getDecodePool()
+    fetchCount = min(len(tiles), interface.maxConcurrentRequests)
+    # Only a few tiles are fetched or decoded at a time, so the raw chunks of a large area are never all held at once.
+    maxTilesInFlight = fetchCount if decoder is None else fetchCount + (maxDecodeProcesses or os.cpu_count() or 1)
+    remainingTiles = iter(tiles)
+    fetches = {}
+    decodes = {}
+    with ThreadPoolExecutor(max_workers=fetchCount, thread_name_prefix='getChunks') as fetcher:
+        while True:
+            while len(fetches) + len(decodes) < maxTilesInFlight:
+                tile = next(remainingTiles, None)
+                if tile is None:
+                    break
+                fetches[fetcher.submit(interface.getChunks, *tile)] = tile
+            if not fetches and not decodes:
+                return
+            for future in wait(list(fetches) + list(decodes), return_when=FIRST_COMPLETED).done:
+                if future in fetches:
+                    tile = fetches.pop(future)
+                    if decoder is not None:
+                        decodes[decoder.submit(decodeChunks, future.result(), heightmapTypes, readSections)] = tile
+                        continue
+                    chunks = decodeChunks(future.result(), heightmapTypes, readSections)
+                else:
+                    tile = decodes.pop(future)
+                    chunks = future.result()
+                _storeTile(tile, chunks, readSections)
+                yield tile, chunks
+
+
+def _getDecodePool():
+    """**Return the shared process pool, None when tiles should be decoded in this process**."""
+    global decodePool
+    processes = maxDecodeProcesses or os.cpu_count() or 1
+    if decodePool is None and processes > 1:
+        decodePool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+    return decodePool
+
+
+def _storeTile(tile, chunks, readSections):
+    if chunkCache is None or not readSections:
+        return
+    for tileChunkID, chunk in enumerate(chunks):
+        chunkCache.store(tile[0] + tileChunkID % tile[2], tile[1] + tileChunkID // tile[2], chunk)
+
+
+def decodeChunks(chunkBytes, heightmapTypes, readSections=True):
+    """**Decode the chunks returned by interface.getChunks into arrays**.
+
+    Returns a (heightmaps, sections, biomes) tuple for every chunk, in the
+    order of the response. Heightmaps are in x, z order, every section is a
+    (y, palette, bitsPerEntry, blockStates) tuple with the palette as
+    (name, properties) pairs and the packed palette indices as int64 longs.
+    Only these payloads are read from the NBT data, everything else is
+    skipped, including the sections if readSections is False. This runs in
+    worker processes, so it only returns picklable values.
+    """
+    return readChunks(chunkBytes, heightmapTypes, readSections)